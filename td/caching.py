@@ -0,0 +1,87 @@
+import time
+
+from django.core.cache import cache
+
+from . import rebuilds
+
+
+# Derived data is keyed by the generations of the models it is built from,
+# e.g. "map_gateways:1445300000123.1445300000456", so a write to any of
+# them moves readers on to a new key and a stale entry is never served.
+LANGUAGE = "language"
+COUNTRY = "country"
+REGION = "region"
+
+DERIVED_TIMEOUT = 60 * 60 * 24
+
+# other models get a generation named by their label, e.g. "imports.sil_iso_639_3"
+MODEL_GENERATIONS = {
+    "td.language": LANGUAGE,
+    "td.country": COUNTRY,
+    "td.region": REGION
+}
+
+
+def generation_key(name):
+    return "generation:{0}".format(name)
+
+
+def model_generation(model):
+    label = "{0}.{1}".format(model._meta.app_label, model._meta.model_name)
+    return MODEL_GENERATIONS.get(label, label)
+
+
+def seed():
+    # Seed from the clock so a flushed cache never hands out a generation
+    # that was already used for a derived key
+    return int(time.time() * 1000)
+
+
+def get_generations(names):
+    keys = [generation_key(name) for name in names]
+    found = cache.get_many(keys)
+    for key in keys:
+        if found.get(key) is None:
+            cache.add(key, seed(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def get_generation(name):
+    return get_generations([name])[0]
+
+
+def bump_now(name):
+    try:
+        return cache.incr(generation_key(name))
+    except ValueError:
+        generation = seed()
+        cache.set(generation_key(name), generation, None)
+        return generation
+
+
+def bump(*names):
+    """
+    Mark the data of `names` as changed. Inside a transaction this happens
+    once it has committed, so nothing is rebuilt from uncommitted rows under
+    the new generation.
+    """
+    for name in names:
+        rebuilds.on_commit(generation_key(name), lambda name=name: bump_now(name))
+
+
+def derived_key(name, depends):
+    return "{0}:{1}".format(name, ".".join(str(x) for x in get_generations(depends)))
+
+
+def get_derived(name, depends, build, timeout=DERIVED_TIMEOUT):
+    """
+    Return the value of `name` for the current generations of `depends`,
+    calling `build` to make and cache it if there is none yet
+    """
+    key = derived_key(name, depends)
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, timeout)
+    return value
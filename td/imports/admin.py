@@ -4,6 +4,8 @@ from .models import (
     EthnologueCountryCode,
     EthnologueLanguageCode,
     EthnologueLanguageIndex,
+    ImportLoad,
+    ImportSource,
     SIL_ISO_639_3,
     WikipediaISOLanguage,
     WikipediaISOCountry
@@ -45,6 +47,17 @@ class EthnologueLanguageIndexAdmin(LockedDownModelAdmin):
     search_fields = ["language_code", "name"]
 
 
+class ImportSourceAdmin(LockedDownModelAdmin):
+    list_display = ["name", "status_code", "etag", "last_modified", "content_hash", "checked_at", "changed_at"]
+    search_fields = ["name", "url"]
+
+
+class ImportLoadAdmin(LockedDownModelAdmin):
+    list_display = ["source", "content_hash", "replayed", "loaded_at"]
+    list_filter = ["source", "replayed"]
+    search_fields = ["content_hash"]
+
+
 class WikipediaISOCountryAdmin(LockedDownModelAdmin):
     list_display = [
         "alpha_2",
@@ -92,6 +105,8 @@ class SIL_ISO_639_3Admin(LockedDownModelAdmin):
 admin.site.register(EthnologueCountryCode, EthnologueCountryCodeAdmin)
 admin.site.register(EthnologueLanguageCode, EthnologueLanguageCodeAdmin)
 admin.site.register(EthnologueLanguageIndex, EthnologueLanguageIndexAdmin)
+admin.site.register(ImportLoad, ImportLoadAdmin)
+admin.site.register(ImportSource, ImportSourceAdmin)
 admin.site.register(WikipediaISOLanguage, WikipediaISOLanguageAdmin)
 admin.site.register(WikipediaISOCountry, WikipediaISOCountryAdmin)
 admin.site.register(SIL_ISO_639_3, SIL_ISO_639_3Admin)
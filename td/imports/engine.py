@@ -0,0 +1,212 @@
+from decimal import Decimal
+from io import BytesIO
+
+from django.db import connection, models, transaction
+from django.utils.encoding import force_text, force_bytes
+
+from td import caching
+from td.utils import bulk_update
+
+
+def normalize(field, value):
+    """
+    Convert a parsed source value to what `field` reads back from the
+    database, so unchanged rows compare equal to their stored versions
+    """
+    value = field.to_python(value)
+    if isinstance(value, bytes):
+        value = force_text(value)
+    if isinstance(field, models.DecimalField) and value is not None:
+        value = value.quantize(Decimal(1).scaleb(-field.decimal_places))
+    return value
+
+
+def copy_escape(value):
+    if value is None:
+        return "\\N"
+    return force_text(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class ReloadEngine(object):
+    """
+    Bulk upsert of parsed source rows into an imports model.
+
+    The model declares its natural key as `reload_key`, a list of field
+    names, and how to build each field from a parsed source row as
+    `reload_fields`, a dict of field name to a source column name, a
+    `(column name, function)` pair, or a callable taking the row. Existing
+    keys are loaded in one query, the rows diffed against them, and only
+    inserts, updates and deletes are written, in batches. With `use_copy`
+    (PostgreSQL only) the rows are instead COPYed into a staging table and
+    merged with three statements. Rows given as sequences rather than
+    mappings are converted by a function `compile(columns)` builds once.
+    """
+
+    batch_size = 1000
+
+    def __init__(self, model, delete_missing=True, use_copy=False):
+        self.model = model
+        self.key = list(model.reload_key)
+        self.mapping = model.reload_fields
+        self.values = [f for f in sorted(self.mapping) if f not in self.key]
+        self.fields = {f: model._meta.get_field(f) for f in self.mapping}
+        self.delete_missing = delete_missing
+        self.use_copy = use_copy and connection.vendor == "postgresql"
+
+    def convert(self, row):
+        record = {}
+        for name, source in self.mapping.items():
+            if isinstance(source, tuple):
+                value = source[1](row[source[0]])
+            else:
+                value = source(row) if callable(source) else row[source]
+            record[name] = normalize(self.fields[name], value)
+        return record
+
+    def compile(self, columns):
+        """
+        Return a converter for rows given as sequences of values in the order
+        of `columns`, with each source column resolved to its position once
+        rather than looked up by name for every row
+        """
+        positions = {column: i for i, column in enumerate(columns)}
+        steps = []
+        for name, source in self.mapping.items():
+            if isinstance(source, tuple):
+                steps.append((name, self.fields[name], positions[source[0]], source[1]))
+            elif callable(source):
+                steps.append((name, self.fields[name], None, source))
+            else:
+                steps.append((name, self.fields[name], positions[source], None))
+
+        def convert(row):
+            mapped = dict(zip(columns, row)) if any(i is None for _, _, i, _ in steps) else None
+            record = {}
+            for name, field, i, func in steps:
+                if i is None:
+                    value = func(mapped)
+                else:
+                    value = row[i] if func is None else func(row[i])
+                record[name] = normalize(field, value)
+            return record
+        return convert
+
+    def records(self, rows, convert=None):
+        """
+        Return converted rows keyed by natural key; a later duplicate of a
+        key replaces the earlier one
+        """
+        convert = convert or self.convert
+        records = {}
+        for row in rows:
+            record = convert(row)
+            records[tuple(record[f] for f in self.key)] = record
+        return records
+
+    def reload(self, rows, columns=None):
+        """
+        Upsert `rows` and return the created, updated, deleted and unchanged
+        counts. Rows are mappings of column name to value, or, if `columns`
+        is given, sequences of values in that order. An empty source is
+        treated as a failed download and leaves the table alone.
+        """
+        records = self.records(rows, self.compile(columns) if columns is not None else None)
+        counts = dict(rows_created=0, rows_updated=0, rows_deleted=0, rows_unchanged=0)
+        if not records:
+            return counts
+        with transaction.atomic():
+            if self.use_copy:
+                self.merge_staged(records, counts)
+            else:
+                self.merge(records, counts)
+        if counts["rows_created"] or counts["rows_updated"] or counts["rows_deleted"]:
+            # bulk writes send no signals to do this
+            caching.bump(caching.model_generation(self.model))
+        return counts
+
+    def existing(self):
+        existing = {}
+        for row in self.model.objects.values_list("pk", *(self.key + self.values)).iterator():
+            existing[tuple(row[1:len(self.key) + 1])] = (row[0], row[len(self.key) + 1:])
+        return existing
+
+    def batch(self, fields, objs):
+        # never more per statement than the backend accepts, e.g. SQLite's
+        # limit on terms in a compound SELECT
+        return max(min(self.batch_size, connection.ops.bulk_batch_size(fields, objs)), 1)
+
+    def merge(self, records, counts):
+        existing = self.existing()
+        created, updated = [], []
+        for key, record in records.items():
+            if key not in existing:
+                created.append(self.model(**record))
+            elif tuple(record[f] for f in self.values) != existing[key][1]:
+                updated.append(dict(record, pk=existing[key][0]))
+        deleted = [pk for key, (pk, _) in existing.items() if key not in records] if self.delete_missing else []
+        fields = [f for f in self.model._meta.concrete_fields if not isinstance(f, models.AutoField)]
+        self.model.objects.bulk_create(created, batch_size=self.batch(fields, created))
+        bulk_update(self.model, updated, self.values, batch_size=self.batch(self.values + ["pk"], updated))
+        size = self.batch(["pk"], deleted)
+        for start in range(0, len(deleted), size):
+            self.model.objects.filter(pk__in=deleted[start:start + size]).delete()
+        counts.update(
+            rows_created=len(created),
+            rows_updated=len(updated),
+            rows_deleted=len(deleted),
+            rows_unchanged=len(records) - len(created) - len(updated)
+        )
+
+    def merge_staged(self, records, counts):
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        columns = self.key + self.values
+        column_list = ", ".join(qn(self.fields[f].column) for f in columns)
+        key_match = " and ".join("t.{0} = s.{0}".format(qn(self.fields[f].column)) for f in self.key)
+        cursor = connection.cursor()
+        cursor.execute("drop table if exists pg_temp.reload_staging")
+        cursor.execute("create temporary table reload_staging on commit drop as select {0} from {1} with no data".format(
+            column_list, table
+        ))
+        data = BytesIO()
+        for record in records.values():
+            data.write(force_bytes("\t".join(copy_escape(record[f]) for f in columns) + "\n"))
+        data.seek(0)
+        cursor.copy_expert("copy reload_staging ({0}) from stdin".format(column_list), data)
+        if self.delete_missing:
+            cursor.execute("delete from {0} t where not exists (select 1 from reload_staging s where {1})".format(
+                table, key_match
+            ))
+            counts["rows_deleted"] = cursor.rowcount
+        if self.values:
+            value_columns = [qn(self.fields[f].column) for f in self.values]
+            cursor.execute(
+                "update {0} t set {1} from reload_staging s where {2} and ({3}) is distinct from ({4})".format(
+                    table,
+                    ", ".join("{0} = s.{0}".format(c) for c in value_columns),
+                    key_match,
+                    ", ".join("t.{0}".format(c) for c in value_columns),
+                    ", ".join("s.{0}".format(c) for c in value_columns)
+                )
+            )
+            counts["rows_updated"] = cursor.rowcount
+        self.insert_staged(cursor, table, column_list, key_match, counts)
+        counts["rows_unchanged"] = len(records) - counts["rows_created"] - counts["rows_updated"]
+
+    def insert_staged(self, cursor, table, column_list, key_match, counts):
+        # fields left out of the mapping get their model defaults, e.g. date_imported
+        defaults = [
+            f for f in self.model._meta.concrete_fields
+            if f.name not in self.mapping and not isinstance(f, models.AutoField)
+        ]
+        qn = connection.ops.quote_name
+        cursor.execute(
+            "insert into {0} ({1}) select {2} from reload_staging s where not exists (select 1 from {0} t where {3})".format(
+                table,
+                ", ".join([column_list] + [qn(f.column) for f in defaults]),
+                ", ".join(["s.{0}".format(qn(self.fields[f].column)) for f in self.key + self.values] + ["%s"] * len(defaults)),
+                key_match
+            ),
+            [f.get_db_prep_save(f.get_default(), connection) for f in defaults]
+        )
+        counts["rows_created"] = cursor.rowcount
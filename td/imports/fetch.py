@@ -1,22 +1,193 @@
+import hashlib
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
 from pinax.eventlog.models import log
 
 
+SNAPSHOT_RETENTION = 5  # loads per source whose snapshots are kept
+SNAPSHOT_GRACE = 24 * 60 * 60  # seconds
+
+
+class SnapshotMissing(Exception):
+    pass
+
+
+def snapshot_path(content_hash):
+    return os.path.join(settings.IMPORTS_SNAPSHOT_ROOT, content_hash[:2], content_hash)
+
+
+def store_snapshot(content):
+    """
+    Keep `content` in the snapshot store under its SHA-1 and return the hash;
+    identical payloads are only stored once
+    """
+    content_hash = hashlib.sha1(content).hexdigest()
+    path = snapshot_path(content_hash)
+    if not os.path.exists(path):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # write aside and rename, so a snapshot is never seen half written
+        fd, temp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(content)
+        os.rename(temp, path)
+    return content_hash
+
+
+def read_snapshot(content_hash):
+    path = snapshot_path(content_hash)
+    if not content_hash or not os.path.exists(path):
+        raise SnapshotMissing("No snapshot {0} in {1}".format(content_hash, settings.IMPORTS_SNAPSHOT_ROOT))
+    with open(path, "rb") as fp:
+        return fp.read()
+
+
+def prune_snapshots():
+    """
+    Delete the snapshots no replay needs any more: all but those of each
+    source's last `SNAPSHOT_RETENTION` loads and the ones the sources were
+    last checked against. Snapshots younger than `SNAPSHOT_GRACE` stay, as
+    they may belong to a load still in progress.
+    """
+    from .models import ImportSource
+    keep = set()
+    for source in ImportSource.objects.all():
+        keep.add(source.content_hash)
+        keep.update(source.loads.values_list("content_hash", flat=True)[:SNAPSHOT_RETENTION])
+    cutoff = time.time() - SNAPSHOT_GRACE
+    for directory, _, names in os.walk(settings.IMPORTS_SNAPSHOT_ROOT):
+        for name in names:
+            path = os.path.join(directory, name)
+            if name not in keep and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+
 class Fetcher(object):
+    """
+    Downloads a source, sending the validators recorded for it by the last
+    load so that an unchanged source costs a 304 and nothing else. Every
+    payload downloaded is kept in the snapshot store, and a fetcher made
+    with `snapshot` set to a content hash serves that stored payload
+    instead of making a request.
+    """
 
     url = None
 
-    def __init__(self, session):
+    def __init__(self, session, snapshot=None):
         self.session = session
+        self.snapshot = snapshot
+        self.source = self.get_source()
+        self.response = None
+        self.elapsed = 0
+        self.validators = {}
+
+    @classmethod
+    def replay(cls, snapshot=None):
+        """
+        Return a fetcher serving `snapshot`, by default the one the source
+        was last loaded from, without network access
+        """
+        fetcher = cls(None)
+        fetcher.snapshot = snapshot or fetcher.source.content_hash
+        if not fetcher.snapshot:
+            raise SnapshotMissing("{0} has not been loaded yet".format(cls.__name__))
+        return fetcher
+
+    def get_source(self):
+        from .models import ImportSource
+        source, _ = ImportSource.objects.get_or_create(name=self.__class__.__name__, defaults={"url": self.url})
+        return source
+
+    def request_headers(self):
+        headers = {}
+        if self.source.etag:
+            headers["If-None-Match"] = self.source.etag
+        if self.source.last_modified:
+            headers["If-Modified-Since"] = self.source.last_modified
+        return headers
+
+    def download(self):
+        """
+        Make the request; touches neither the database nor the log, so it
+        can run in another thread ahead of `fetch()`
+        """
+        if self.snapshot:
+            return None
+        started = time.time()
+        self.response = self.session.get(self.url, headers=self.request_headers())
+        self.elapsed = time.time() - started
+        return self.response
 
     def fetch(self):
-        response = self.session.get(self.url)
+        """
+        Return the source's content, or None if it failed to download or is
+        unchanged since the last load; call `loaded()` once it is stored
+        """
+        if self.snapshot:
+            return self.fetch_snapshot()
+        response = self.response if self.response is not None else self.download()
+        self.source.url = self.url
+        self.source.checked_at = timezone.now()
+        self.source.status_code = response.status_code
+        if response.status_code == 304:
+            self.source.save()
+            return None
         if response.status_code != 200:
             log(
                 user=None,
                 action=self.error_action_label,
                 extra={"status_code": response.status_code, "text": response.content}
             )
-        return response.content
+            self.source.save()
+            return None
+        content = response.content
+        if not content:
+            log(
+                user=None,
+                action=self.error_action_label,
+                extra={"status_code": response.status_code, "text": "empty response"}
+            )
+            self.source.save()
+            return None
+        self.validators = {
+            "etag": response.headers.get("ETag", ""),
+            "last_modified": response.headers.get("Last-Modified", ""),
+            "content_hash": store_snapshot(content)
+        }
+        if self.validators["content_hash"] == self.source.content_hash:
+            # the server does not support validators or ignored them
+            self.store_validators()
+            return None
+        return content
+
+    def fetch_snapshot(self):
+        content = read_snapshot(self.snapshot)
+        # the table no longer matches what the validators describe, so the
+        # next fetch downloads in full and compares by hash
+        self.validators = {"etag": "", "last_modified": "", "content_hash": self.snapshot}
+        return content
+
+    def store_validators(self):
+        for attr, value in self.validators.items():
+            setattr(self.source, attr, value)
+        self.source.save()
+
+    def loaded(self):
+        """
+        Record the validators of the fetched content once it has been loaded,
+        so the next fetch of unchanged content is skipped, and which snapshot
+        the load used
+        """
+        self.source.changed_at = timezone.now()
+        self.store_validators()
+        self.source.loads.create(content_hash=self.validators["content_hash"], replayed=bool(self.snapshot))
+        prune_snapshots()
 
 
 class WikipediaFetcher(Fetcher):
@@ -0,0 +1,129 @@
+import json
+import os
+import resource
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from td.models import Country
+from td.rebuilds import deferred_rebuilds
+from td.tasks import update_countries_from_imports, integrate_imports
+
+from ...models import (
+    EthnologueCountryCode,
+    EthnologueLanguageCode,
+    EthnologueLanguageIndex,
+    IMBPeopleGroup,
+    SIL_ISO_639_3,
+    WikipediaISOCountry,
+    WikipediaISOLanguage
+)
+from .reload_imports import SOURCES
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "tests", "data")
+
+FILES = {
+    WikipediaISOCountry: "wikipedia_country.html",
+    WikipediaISOLanguage: "wikipedia.html",
+    SIL_ISO_639_3: "iso_639_3.tab",
+    EthnologueCountryCode: "CountryCodes.tab",
+    EthnologueLanguageCode: "LanguageCodes.tab",
+    EthnologueLanguageIndex: "LanguageIndex.tab",
+    IMBPeopleGroup: "imb_people_groups.xls"
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+def peak_rss():
+    # the highest RSS of the whole process so far, in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(stage, func):
+    """
+    Run `func`, which returns the number of rows it processed, and return
+    its timings and query count. Memory is the process's peak RSS so far,
+    not the stage's own, and how far the stage raised it; a stage that
+    stays under an earlier stage's peak shows no growth.
+    """
+    rss = peak_rss()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.time()
+        rows = func()
+        seconds = time.time() - started
+    return {
+        "stage": stage,
+        "seconds": round(seconds, 4),
+        "rows": rows,
+        "rows_per_second": round(rows / seconds, 1) if seconds else None,
+        "queries": len(queries),
+        "process_peak_rss_kb": peak_rss(),
+        "process_peak_rss_growth_kb": peak_rss() - rss
+    }
+
+
+def reload_stage(model, path):
+    def run():
+        with open(path, "rb") as fp:
+            model.load(fp.read())
+        return model.objects.count()
+    return run
+
+
+def countries_stage():
+    update_countries_from_imports()
+    return Country.objects.count()
+
+
+def integration_stage():
+    counts = integrate_imports()
+    return counts["created"] + counts["updated"] + counts["unchanged"]
+
+
+class Command(BaseCommand):
+    help = "time the import pipeline against the bundled test data and report the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--data-dir", default=DATA_DIR, help="directory holding the source files")
+        parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            default=False,
+            help="commit the loaded data instead of rolling it back"
+        )
+
+    def stages(self, data_dir):
+        for model in SOURCES:
+            yield "{0}.reload".format(model.__name__), reload_stage(model, os.path.join(data_dir, FILES[model]))
+        yield "update_countries_from_imports", countries_stage
+        yield "integrate_imports", integration_stage
+
+    def handle(self, *args, **options):
+        results = []
+        started = time.time()
+        try:
+            # one transaction, so the benchmark leaves the database as it was
+            with deferred_rebuilds():
+                for stage, func in self.stages(options["data_dir"]):
+                    results.append(measure(stage, func))
+                if not options["keep"]:
+                    raise Rollback()
+        except Rollback:
+            pass
+        report = json.dumps({
+            "stages": results,
+            "total_seconds": round(time.time() - started, 4),
+            "kept": options["keep"]
+        }, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as fp:
+                fp.write(report)
+        else:
+            self.stdout.write(report)
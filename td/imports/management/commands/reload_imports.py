@@ -1,19 +1,95 @@
+import time
+
+from multiprocessing.pool import ThreadPool
+
 from django.core.management.base import BaseCommand
 
 import requests
 
-from ... import models
+from ...fetch import SnapshotMissing
+from ...models import (
+    EthnologueCountryCode,
+    EthnologueLanguageCode,
+    EthnologueLanguageIndex,
+    IMBPeopleGroup,
+    SIL_ISO_639_3,
+    WikipediaISOCountry,
+    WikipediaISOLanguage
+)
 from td.tasks import update_countries_from_imports, integrate_imports
 
 
+# the order sources are loaded in once downloaded
+SOURCES = [
+    WikipediaISOCountry,
+    WikipediaISOLanguage,
+    SIL_ISO_639_3,
+    EthnologueCountryCode,
+    EthnologueLanguageCode,
+    EthnologueLanguageIndex,
+    IMBPeopleGroup
+]
+
+
+def download(fetcher):
+    try:
+        fetcher.download()
+    except requests.RequestException as e:
+        return e
+
+
 class Command(BaseCommand):
     help = "reload all imports"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="number of concurrent downloads")
+        parser.add_argument(
+            "--from-snapshot",
+            action="store_true",
+            default=False,
+            help="reload each source from the snapshot it was last loaded from, without network access"
+        )
+
+    def get_fetchers(self, from_snapshot):
+        fetchers = []
+        for model in SOURCES:
+            if not from_snapshot:
+                # requests sessions are not thread-safe, so each download gets its own
+                fetchers.append((model, model.fetcher_class(requests.Session())))
+                continue
+            try:
+                fetchers.append((model, model.fetcher_class.replay()))
+            except SnapshotMissing as e:
+                self.stdout.write("{0}: skipped, {1}".format(model._meta.verbose_name, e))
+        return fetchers
+
     def handle(self, *args, **options):
-        session = requests.Session()
-        for obj in models.__dict__.values():
-            if hasattr(obj, "reload") and callable(obj.reload):
-                print "Loading {} records".format(obj._meta.verbose_name)
-                obj.reload(session)
+        fetchers = self.get_fetchers(options["from_snapshot"])
+        started = time.time()
+        pool = ThreadPool(max(1, min(options["workers"], len(fetchers))))
+        try:
+            errors = pool.map(download, [fetcher for _, fetcher in fetchers])
+        finally:
+            pool.close()
+            pool.join()
+        fetching = time.time() - started
+        for (model, fetcher), error in zip(fetchers, errors):
+            name = model._meta.verbose_name
+            if error is not None:
+                self.stdout.write("{0}: download failed after {1:.2f}s ({2})".format(name, fetcher.elapsed, error))
+                continue
+            loading = time.time()
+            loaded = model.load_fetched(fetcher)
+            self.stdout.write("{0}: {1} {2:.2f}s, load {3:.2f}s{4}".format(
+                name,
+                "snapshot {0}".format(fetcher.snapshot[:12]) if fetcher.snapshot else "download",
+                fetcher.elapsed,
+                time.time() - loading,
+                "" if loaded else " (nothing new)"
+            ))
+        downloads = sum(fetcher.elapsed for _, fetcher in fetchers)
+        self.stdout.write("Fetched {0} sources in {1:.2f}s, {2:.2f}s less than one after another".format(
+            len(fetchers), fetching, max(0, downloads - fetching)
+        ))
         update_countries_from_imports()
         integrate_imports()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imports', '0002_wikipediaisocountry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportSource',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(unique=True, max_length=100)),
+                ('url', models.CharField(max_length=255)),
+                ('etag', models.CharField(max_length=255, verbose_name='ETag', blank=True)),
+                ('last_modified', models.CharField(max_length=50, blank=True)),
+                ('content_hash', models.CharField(max_length=40, blank=True)),
+                ('status_code', models.IntegerField(null=True, blank=True)),
+                ('checked_at', models.DateTimeField(null=True, blank=True)),
+                ('changed_at', models.DateTimeField(null=True, blank=True)),
+            ],
+            options={
+                'verbose_name': 'Import Source',
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imports', '0003_importsource'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportLoad',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('content_hash', models.CharField(max_length=40)),
+                ('replayed', models.BooleanField(default=False)),
+                ('loaded_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('source', models.ForeignKey(related_name='loads', to='imports.ImportSource')),
+            ],
+            options={
+                'ordering': ['-loaded_at'],
+                'verbose_name': 'Import Load',
+            },
+            bases=(models.Model,),
+        ),
+    ]
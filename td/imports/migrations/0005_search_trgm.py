@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import warnings
+
+from django.db import DatabaseError, migrations, transaction
+
+
+# the search fields of the data source views using TrigramSearch
+SEARCH_COLUMNS = {
+    "imports_sil_iso_639_3": [
+        "code", "part_2b", "part_2t", "part_1", "scope", "language_type", "ref_name", "comment"
+    ],
+    "imports_ethnologuelanguageindex": [
+        "language_code", "country_code", "name_type", "name"
+    ],
+    "imports_imbpeoplegroup": [
+        "peid", "affinity_bloc", "people_cluster", "sub_continent", "country", "country_of_origin",
+        "people_group", "population", "dispersed", "rol", "language", "religion", "written_scripture",
+        "jesus_film", "radio_broadcast", "gospel_recording", "audio_scripture", "bible_stories"
+    ],
+}
+
+
+def search_document(columns):
+    # must stay identical to td.utils.search_document as of this migration
+    return " || E'\\n' || ".join(
+        "coalesce(upper(\"{0}\"::text), '')".format(column) for column in columns
+    )
+
+
+def create_extension(schema_editor):
+    connection = schema_editor.connection
+    cursor = connection.cursor()
+    cursor.execute("select 1 from pg_available_extensions where name = 'pg_trgm'")
+    if cursor.fetchone() is None:
+        return False
+    try:
+        with transaction.atomic(using=connection.alias):
+            schema_editor.execute("create extension if not exists pg_trgm")
+    except DatabaseError:
+        # e.g. the migrating role may not create extensions
+        return False
+    return True
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    if not create_extension(schema_editor):
+        # searches still work, just without the index
+        warnings.warn("pg_trgm could not be enabled; data source search indexes not created")
+        return
+    for table, columns in SEARCH_COLUMNS.items():
+        schema_editor.execute(
+            "create index \"{0}_search_trgm\" on \"{0}\" using gin (({1}) gin_trgm_ops)".format(
+                table, search_document(columns)
+            )
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table in SEARCH_COLUMNS:
+        schema_editor.execute("drop index if exists \"{0}_search_trgm\"".format(table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imports', '0004_importload'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imports', '0005_search_trgm'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='ethnologuelanguageindex',
+            index_together=set([('language_code', 'id'), ('country_code', 'id'), ('name_type', 'id'), ('name', 'id')]),
+        ),
+    ]
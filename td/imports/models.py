@@ -15,11 +15,92 @@ import bs4
 import xlrd
 
 from pinax.eventlog.models import log
+from td import caching
 from . import fetch
+from .engine import ReloadEngine
+
+
+def log_extra(counts):
+    # reload log entries, and whatever reads them, have always used "rows-updated"
+    extra = dict(counts)
+    extra["rows-updated"] = extra.pop("rows_updated")
+    return extra
+
+
+def nullable_bool(value):
+    return str_to_bool(value, allow_null=True)
+
+
+class SourceReload(object):
+    """
+    Reloads an imports model from what its `fetcher_class` downloads; the
+    model's `load` parses and stores the content and returns whether it
+    found anything to store
+    """
+
+    fetcher_class = None
+
+    @classmethod
+    def reload(cls, session):
+        cls.load_fetched(cls.fetcher_class(session))
+
+    @classmethod
+    def replay(cls, snapshot=None):
+        """
+        Load a stored snapshot of the source, by default the last one loaded
+        """
+        return cls.load_fetched(cls.fetcher_class.replay(snapshot))
+
+    @classmethod
+    def load_fetched(cls, fetcher):
+        content = fetcher.fetch()
+        if content and cls.load(content):
+            fetcher.loaded()
+            return True
+        return False
 
 
 @python_2_unicode_compatible
-class WikipediaISOCountry(models.Model):
+class ImportSource(models.Model):
+    """
+    The HTTP validators and content hash of the last load of each source
+    """
+    name = models.CharField(max_length=100, unique=True)
+    url = models.CharField(max_length=255)
+    etag = models.CharField(max_length=255, blank=True, verbose_name="ETag")
+    last_modified = models.CharField(max_length=50, blank=True)
+    content_hash = models.CharField(max_length=40, blank=True)
+    status_code = models.IntegerField(null=True, blank=True)
+    checked_at = models.DateTimeField(null=True, blank=True)
+    changed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = "Import Source"
+
+
+@python_2_unicode_compatible
+class ImportLoad(models.Model):
+    """
+    A load of a source, with the hash of the snapshot it was loaded from
+    """
+    source = models.ForeignKey(ImportSource, related_name="loads")
+    content_hash = models.CharField(max_length=40)
+    replayed = models.BooleanField(default=False)
+    loaded_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return "{0} {1}".format(self.source, self.content_hash)
+
+    class Meta:
+        verbose_name = "Import Load"
+        ordering = ["-loaded_at"]
+
+
+@python_2_unicode_compatible
+class WikipediaISOCountry(SourceReload, models.Model):
     english_short_name = models.CharField(max_length=100)
     alpha_2 = models.CharField(max_length=2)
     alpha_3 = models.CharField(max_length=3)
@@ -33,11 +114,10 @@ class WikipediaISOCountry(models.Model):
         verbose_name = "Wikipedia ISO 3166-1 Country"
         verbose_name_plural = "Wikipedia ISO 3166-1 Countries"
 
+    fetcher_class = fetch.WikipediaCountryFetcher
+
     @classmethod
-    def reload(cls, session):
-        content = fetch.WikipediaCountryFetcher(session).fetch()
-        if not content:
-            return
+    def load(cls, content):
         soup = bs4.BeautifulSoup(content, "html.parser")
         records = []
         for tr in soup.select("table.sortable tr"):
@@ -54,9 +134,10 @@ class WikipediaISOCountry(models.Model):
             cls.objects.all().delete()
             cls.objects.bulk_create(records)
             log(user=None, action="SOURCE_WIKIPEDIA_COUNTRIES_RELOADED", extra={})
+            return True
 
 
-class WikipediaISOLanguage(models.Model):
+class WikipediaISOLanguage(SourceReload, models.Model):
 
     language_family = models.CharField(max_length=100)
     language_name = models.CharField(max_length=100)
@@ -78,11 +159,10 @@ class WikipediaISOLanguage(models.Model):
     class Meta:
         verbose_name = "Wikipedia ISO Language"
 
+    fetcher_class = fetch.WikipediaFetcher
+
     @classmethod
-    def reload(cls, session):
-        content = fetch.WikipediaFetcher(session).fetch()
-        if not content:
-            return
+    def load(cls, content):
         soup = bs4.BeautifulSoup(content, "html.parser")
         records = []
         for tr in soup.select("table.wikitable tr"):
@@ -102,10 +182,12 @@ class WikipediaISOLanguage(models.Model):
         if len(records) > 0:
             cls.objects.all().delete()
             cls.objects.bulk_create(records)
+            caching.bump(caching.model_generation(cls))
             log(user=None, action="SOURCE_WIKIPEDIA_RELOADED", extra={})
+            return True
 
 
-class SIL_ISO_639_3(models.Model):
+class SIL_ISO_639_3(SourceReload, models.Model):
 
     SCOPE_INDIVIDUAL = "I"
     SCOPE_MACRO_LANGUAGE = "M"
@@ -150,41 +232,29 @@ class SIL_ISO_639_3(models.Model):
     class Meta:
         verbose_name = "SIL ISO Code Set"
 
+    reload_key = ["code"]
+    reload_fields = {
+        "code": "Id",
+        "part_2b": lambda row: row["Part2B"] or "",
+        "part_2t": lambda row: row["Part2T"] or "",
+        "part_1": lambda row: row["Part1"] or "",
+        "scope": "Scope",
+        "language_type": "Language_Type",
+        "ref_name": "Ref_Name",
+        "comment": lambda row: row["Comment"] or ""
+    }
+
+    fetcher_class = fetch.ISO_639_3Fetcher
+
     @classmethod
-    def reload(cls, session):
-        content = fetch.ISO_639_3Fetcher(session).fetch()
-        if not content:
-            return
+    def load(cls, content):
         reader = csv.DictReader(StringIO(content), dialect="excel-tab")
-        rows_updated = rows_created = 0
-        for row in reader:
-            defaults = dict(
-                part_2b=row["Part2B"] or "",
-                part_2t=row["Part2T"] or "",
-                part_1=row["Part1"] or "",
-                scope=row["Scope"],
-                language_type=row["Language_Type"],
-                ref_name=row["Ref_Name"],
-                comment=row["Comment"] or ""
-            )
-            record, created = cls.objects.get_or_create(
-                code=row["Id"],
-                defaults=defaults
-            )
-            if created:
-                rows_created += 1
-            else:
-                for key in defaults:
-                    setattr(record, key, defaults[key])
-                record.save()
-                rows_updated += 1
-        log(user=None, action="SOURCE_SIL_ISO_639_3_RELOADED", extra={
-            "rows_created": rows_created,
-            "rows-updated": rows_updated
-        })
-
-
-class EthnologueLanguageCode(models.Model):
+        counts = ReloadEngine(cls).reload(reader)
+        log(user=None, action="SOURCE_SIL_ISO_639_3_RELOADED", extra=log_extra(counts))
+        return any(counts.values())
+
+
+class EthnologueLanguageCode(SourceReload, models.Model):
 
     STATUS_EXTINCT = "E"
     STATUS_LIVING = "L"
@@ -208,37 +278,25 @@ class EthnologueLanguageCode(models.Model):
     class Meta:
         verbose_name = "Ethnologue Language Code"
 
+    reload_key = ["code"]
+    reload_fields = {
+        "code": "LangID",
+        "country_code": "CountryID",
+        "status": "LangStatus",
+        "name": "Name"
+    }
+
+    fetcher_class = fetch.EthnologueLanguageCodesFetcher
+
     @classmethod
-    def reload(cls, session):
-        content = fetch.EthnologueLanguageCodesFetcher(session).fetch()
-        if not content:
-            return
+    def load(cls, content):
         reader = csv.DictReader(StringIO(content), dialect="excel-tab")
-        rows_updated = rows_created = 0
-        for row in reader:
-            defaults = dict(
-                country_code=row["CountryID"],
-                status=row["LangStatus"],
-                name=row["Name"],
-            )
-            record, created = cls.objects.get_or_create(
-                code=row["LangID"],
-                defaults=defaults
-            )
-            if created:
-                rows_created += 1
-            else:
-                for key in defaults:
-                    setattr(record, key, defaults[key])
-                record.save()
-                rows_updated += 1
-        log(user=None, action="SOURCE_ETHNOLOGUE_LANG_CODE_RELOADED", extra={
-            "rows_created": rows_created,
-            "rows-updated": rows_updated
-        })
-
-
-class EthnologueCountryCode(models.Model):
+        counts = ReloadEngine(cls).reload(reader)
+        log(user=None, action="SOURCE_ETHNOLOGUE_LANG_CODE_RELOADED", extra=log_extra(counts))
+        return any(counts.values())
+
+
+class EthnologueCountryCode(SourceReload, models.Model):
 
     code = models.CharField(max_length=2, unique=True)
     name = models.CharField(max_length=75)
@@ -254,36 +312,24 @@ class EthnologueCountryCode(models.Model):
     class Meta:
         verbose_name = "Ethnologue Country Code"
 
+    reload_key = ["code"]
+    reload_fields = {
+        "code": "CountryID",
+        "name": "Name",
+        "area": "Area"
+    }
+
+    fetcher_class = fetch.EthnologueCountryCodesFetcher
+
     @classmethod
-    def reload(cls, session):
-        content = fetch.EthnologueCountryCodesFetcher(session).fetch()
-        if not content:
-            return
+    def load(cls, content):
         reader = csv.DictReader(StringIO(content), dialect="excel-tab")
-        rows_updated = rows_created = 0
-        for row in reader:
-            defaults = dict(
-                name=row["Name"],
-                area=row["Area"]
-            )
-            record, created = cls.objects.get_or_create(
-                code=row["CountryID"],
-                defaults=defaults
-            )
-            if created:
-                rows_created += 1
-            else:
-                for key in defaults:
-                    setattr(record, key, defaults[key])
-                record.save()
-                rows_updated += 1
-        log(user=None, action="SOURCE_ETHNOLOGUE_COUNTRY_CODE_RELOADED", extra={
-            "rows_created": rows_created,
-            "rows-updated": rows_updated
-        })
-
-
-class EthnologueLanguageIndex(models.Model):
+        counts = ReloadEngine(cls).reload(reader)
+        log(user=None, action="SOURCE_ETHNOLOGUE_COUNTRY_CODE_RELOADED", extra=log_extra(counts))
+        return any(counts.values())
+
+
+class EthnologueLanguageIndex(SourceReload, models.Model):
 
     TYPE_LANGUAGE = "L"
     TYPE_LANGUAGE_ALTERNATE = "LA"
@@ -315,33 +361,32 @@ class EthnologueLanguageIndex(models.Model):
     class Meta:
         verbose_name = "Ethnologue Language Index"
         verbose_name_plural = "Ethnologue Language Index"
+        # keyset pagination seeks on (sort column, id)
+        index_together = [
+            ("language_code", "id"), ("country_code", "id"), ("name_type", "id"), ("name", "id")
+        ]
+
+    # every column is part of the key; rows are only ever added or removed
+    reload_key = ["language_code", "country_code", "name_type", "name"]
+    reload_fields = {
+        "language_code": "LangID",
+        "country_code": "CountryID",
+        "name_type": "NameType",
+        "name": "Name"
+    }
+
+    fetcher_class = fetch.EthnologueLanguageIndexFetcher
 
     @classmethod
-    def reload(cls, session):
-        content = fetch.EthnologueLanguageIndexFetcher(session).fetch()
-        if not content:
-            return
+    def load(cls, content):
         reader = csv.DictReader(StringIO(content), dialect="excel-tab")
-        rows_updated = rows_created = 0
-        for row in reader:
-            record, created = cls.objects.get_or_create(
-                language_code=row["LangID"],
-                country_code=row["CountryID"],
-                name_type=row["NameType"],
-                name=row["Name"]
-            )
-            if created:
-                rows_created += 1
-            else:
-                rows_updated += 1  # @@@ Should never be an update on this table
-        log(user=None, action="SOURCE_ETHNOLOGUE_LANG_INDEX_RELOADED", extra={
-            "rows_created": rows_created,
-            "rows-updated": rows_updated
-        })
+        counts = ReloadEngine(cls, use_copy=True).reload(reader)
+        log(user=None, action="SOURCE_ETHNOLOGUE_LANG_INDEX_RELOADED", extra=log_extra(counts))
+        return any(counts.values())
 
 
 @python_2_unicode_compatible
-class IMBPeopleGroup(models.Model):
+class IMBPeopleGroup(SourceReload, models.Model):
     peid = models.BigIntegerField(primary_key=True, verbose_name="PEID")
     affinity_bloc = models.CharField(max_length=75)
     people_cluster = models.CharField(max_length=75)
@@ -390,75 +435,91 @@ class IMBPeopleGroup(models.Model):
         verbose_name = "IMB People Group"
         verbose_name_plural = "IMB People Groups"
 
+    reload_key = ["peid"]
+    reload_fields = {
+        "peid": "PEID",
+        "affinity_bloc": "Affinity Bloc",
+        "people_cluster": "People Cluster",
+        "continent": "Continent",
+        "sub_continent": "Sub-Continent",
+        "country": "Country",
+        "country_of_origin": "Country of Origin",
+        "people_group": "People Group",
+        "global_status_evangelical_christianity": "Global Status of  Evangelical Christianity",
+        "evangelical_engagement": ("Evangelical Engagement", str_to_bool),
+        "population": "Population",
+        "dispersed": ("Dispersed (Yes/No)", nullable_bool),
+        "rol": "ROL",
+        "language": "Language",
+        "religion": "Religion",
+        "written_scripture": ("Written Scripture", str_to_bool),
+        "jesus_film": ("Jesus Film", str_to_bool),
+        "radio_broadcast": ("Radio Broadcast", str_to_bool),
+        "gospel_recording": ("Gospel Recording", str_to_bool),
+        "audio_scripture": ("Audio Scripture", str_to_bool),
+        "bible_stories": ("Bible Stories", str_to_bool),
+        "resources": "Resources",
+        "physical_exertion": "Physical Exertion",
+        "freedom_index": "Freedom Index",
+        "government_restrictions_index": "Government Restrictions Index",
+        "social_hostilities_index": "Social Hostilities Index",
+        "threat_level": "Threat Level",
+        "prayer_threads": ("Prayer Threads", nullable_bool),
+        "sbc_embracing_relationship": ("SBC Embracing Relationship", nullable_bool),
+        "embracing_priority": ("Embracing Priority", str_to_bool),
+        "rop1": "ROP1",
+        "rop2": "ROP2",
+        "rop3": "ROP3",
+        "people_name": "People Name",
+        "fips": "FIPS",
+        "fips_of_origin": "FIPS of Origin",
+        "latitude": "Latitude",
+        "longitude": "Longitude",
+        "peid_of_origin": "PEID of Origin",
+        "imb_affinity_group": "IMB Affinity Group"
+    }
+
     @classmethod
-    def reload(cls, session):
-        content = fetch.IMBPeopleFetcher(session).fetch()
-        if content is None or content == "":
-            return
-        book = xlrd.open_workbook(file_contents=content)
-        sheet = book.sheet_by_index(0)
-        key_cell = (4, 0)   # todo: replace this with code to "find" the PEID column properly
-        sh_field_names = [sheet.cell_value(key_cell[0], key_cell[1] + x) for x in range(0, 40)]
-        current_row_num = key_cell[0] + 1
-        rows_created = rows_updated = 0
-        while True:
-            row = {sh_field_names[x]: sheet.cell_value(current_row_num, x) for x in range(0, 40)}
-            if str(row["PEID"]) == "":
-                break
-            defaults = dict(
-                affinity_bloc=row["Affinity Bloc"],
-                people_cluster=row["People Cluster"],
-                continent=row["Continent"],
-                sub_continent=row["Sub-Continent"],
-                country=row["Country"],
-                country_of_origin=row["Country of Origin"],
-                people_group=row["People Group"],
-                global_status_evangelical_christianity=row["Global Status of  Evangelical Christianity"],
-                evangelical_engagement=str_to_bool(row["Evangelical Engagement"]),
-                population=row["Population"],
-                dispersed=str_to_bool(row["Dispersed (Yes/No)"], allow_null=True),
-                rol=row["ROL"],
-                language=row["Language"],
-                religion=row["Religion"],
-                written_scripture=str_to_bool(row["Written Scripture"]),
-                jesus_film=str_to_bool(row["Jesus Film"]),
-                radio_broadcast=str_to_bool(row["Radio Broadcast"]),
-                gospel_recording=str_to_bool(row["Gospel Recording"]),
-                audio_scripture=str_to_bool(row["Audio Scripture"]),
-                bible_stories=str_to_bool(row["Bible Stories"]),
-                resources=row["Resources"],
-                physical_exertion=row["Physical Exertion"],
-                freedom_index=row["Freedom Index"],
-                government_restrictions_index=row["Government Restrictions Index"],
-                social_hostilities_index=row["Social Hostilities Index"],
-                threat_level=row["Threat Level"],
-                prayer_threads=str_to_bool(row["Prayer Threads"], allow_null=True),
-                sbc_embracing_relationship=str_to_bool(row["SBC Embracing Relationship"], allow_null=True),
-                embracing_priority=str_to_bool(row["Embracing Priority"]),
-                rop1=row["ROP1"],
-                rop2=row["ROP2"],
-                rop3=row["ROP3"],
-                people_name=row["People Name"],
-                fips=row["FIPS"],
-                fips_of_origin=row["FIPS of Origin"],
-                latitude=row["Latitude"],
-                longitude=row["Longitude"],
-                peid_of_origin=row["PEID of Origin"],
-                imb_affinity_group=row["IMB Affinity Group"]
-            )
-            record, created = cls.objects.get_or_create(
-                peid=row["PEID"],
-                defaults=defaults
-            )
-            if created:
-                rows_created += 1
-            else:
-                for key in defaults:
-                    setattr(record, key, defaults[key])
-                record.save()
-                rows_updated += 1
-            current_row_num += 1
-        log(user=None, action="SOURCE_IMB_PEOPLE_GROUPS_LOADED", extra={
-            "rows_created": rows_created,
-            "rows-updated": rows_updated
-        })
+    def find_header(cls, sheet, max_rows=20):
+        """
+        Return the (row, column) of the "PEID" heading that starts the table
+        of people groups, below the title rows of the sheet
+        """
+        for row in range(min(max_rows, sheet.nrows)):
+            values = sheet.row_values(row)
+            if "PEID" in values:
+                return row, values.index("PEID")
+        raise ValueError("No PEID column found in the people groups sheet")
+
+    @classmethod
+    def sheet_rows(cls, sheet):
+        """
+        Return the column headings of the sheet and a generator of its data
+        rows as lists of values, up to the first row without a PEID
+        """
+        header_row, first_col = cls.find_header(sheet)
+        columns = sheet.row_values(header_row, first_col)
+        while columns and columns[-1] == "":
+            columns.pop()
+        end_col = first_col + len(columns)
+
+        def rows():
+            for row in range(header_row + 1, sheet.nrows):
+                values = sheet.row_values(row, first_col, end_col)
+                if values[0] == "":
+                    break
+                yield values
+        return columns, rows()
+
+    fetcher_class = fetch.IMBPeopleFetcher
+
+    @classmethod
+    def load(cls, content):
+        book = xlrd.open_workbook(file_contents=content, on_demand=True)
+        try:
+            columns, rows = cls.sheet_rows(book.sheet_by_index(0))
+            counts = ReloadEngine(cls).reload(rows, columns=columns)
+        finally:
+            book.release_resources()
+        log(user=None, action="SOURCE_IMB_PEOPLE_GROUPS_LOADED", extra=log_extra(counts))
+        return any(counts.values())
@@ -0,0 +1,60 @@
+import json
+import os
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from mock import patch
+
+from td import caching
+from td.tests.utils import committed
+
+from ..models import SIL_ISO_639_3
+
+
+class DataTableCountTests(TestCase):
+
+    def setUp(self):
+        caching.bump_now(caching.model_generation(SIL_ISO_639_3))
+        for code in ["aaa", "bbb", "ccc"]:
+            SIL_ISO_639_3.objects.create(code=code, ref_name=code.title(), scope="I", language_type="L")
+
+    def fetch(self, search=""):
+        response = self.client.get(reverse("ajax_ds_sil"), {
+            "draw": "1", "start": "0", "length": "2", "search[value]": search,
+            "order[0][column]": "0", "order[0][dir]": "asc"
+        })
+        return json.loads(response.content)
+
+    def test_counts(self):
+        data = self.fetch()
+        self.assertEquals((data["recordsTotal"], data["recordsFiltered"]), (3, 3))
+        self.assertEquals([row[0] for row in data["data"]], ["aaa", "bbb"])
+        data = self.fetch("bb")
+        self.assertEquals((data["recordsTotal"], data["recordsFiltered"]), (3, 1))
+
+    def test_total_cached_per_generation(self):
+        self.fetch()
+        with self.assertNumQueries(1):
+            self.fetch()
+        with self.assertNumQueries(2):
+            self.fetch("bb")
+        SIL_ISO_639_3.objects.create(code="ddd", ref_name="Ddd", scope="I", language_type="L")
+        self.assertEquals(self.fetch()["recordsTotal"], 3)
+        with committed():
+            caching.bump(caching.model_generation(SIL_ISO_639_3))
+        self.assertEquals(self.fetch()["recordsTotal"], 4)
+
+    def test_reload_bumps_generation(self):
+        self.fetch()
+        SIL_ISO_639_3.objects.bulk_create([SIL_ISO_639_3(code="eee", ref_name="Eee", scope="I", language_type="L")])
+        self.assertEquals(self.fetch()["recordsTotal"], 3)
+        with committed():
+            SIL_ISO_639_3.load(open(os.path.join(os.path.dirname(__file__), "data", "iso_639_3.tab")).read())
+        self.assertEquals(self.fetch()["recordsTotal"], SIL_ISO_639_3.objects.count())
+
+    def test_large_tables_use_estimate(self):
+        with patch("td.utils.estimated_count", return_value=250000):
+            data = self.fetch()
+        self.assertEquals((data["recordsTotal"], data["recordsFiltered"]), (250000, 250000))
+        self.assertEquals(len(data["data"]), 2)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import json
+from unittest import skipIf, skipUnless
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from td.models import Country, Language
+from td.utils import KeysetPaginator
+
+from ..models import EthnologueLanguageIndex
+
+
+class KeysetPaginatorTests(TestCase):
+
+    def setUp(self):
+        countries = [None, Country.objects.create(code="k1", name="B"), Country.objects.create(code="k2", name="A")]
+        for i in range(17):
+            Language.objects.create(
+                code="k{0:02d}".format(i), name="Same" if i % 3 else "Lang", country=countries[i % 3],
+                native_speakers=None if i % 4 else i
+            )
+
+    def pages(self, ordering, per_page=4):
+        queryset = Language.objects.filter(code__startswith="k").order_by(ordering)
+        paginator = KeysetPaginator.for_queryset(queryset, per_page)
+        rows = []
+        for start in range(0, 17, per_page):
+            rows.extend(x["code"] for x in paginator.page(start, lambda qs: qs.values("code", paginator.field, "pk")))
+        return rows, list(paginator.queryset.values_list("code", flat=True))
+
+    def test_matches_offset_paging(self):
+        for ordering in ["name", "-name", "code", "-code", "gateway_flag"]:
+            rows, expected = self.pages(ordering)
+            self.assertEquals(rows, expected, ordering)
+
+    @skipUnless(connection.features.nulls_order_largest, "keyset paging needs NULLs sorted last")
+    def test_nullable_field_matches_offset_paging(self):
+        for ordering in ["native_speakers", "-native_speakers"]:
+            rows, expected = self.pages(ordering)
+            self.assertEquals(rows, expected, ordering)
+
+    @skipIf(connection.features.nulls_order_largest, "NULLs sort last")
+    def test_nullable_field_uses_offset(self):
+        self.assertIsNone(KeysetPaginator.for_queryset(Language.objects.order_by("native_speakers"), 10))
+
+    def test_unsupported_orderings(self):
+        self.assertIsNone(KeysetPaginator.for_queryset(Language.objects.all(), 10))
+        self.assertIsNone(KeysetPaginator.for_queryset(Language.objects.order_by("name", "code"), 10))
+        self.assertIsNone(KeysetPaginator.for_queryset(Language.objects.order_by("cc"), 10))
+        self.assertIsNone(KeysetPaginator.for_queryset(Language.objects.order_by("country__name"), 10))
+
+
+class KeysetViewTests(TestCase):
+
+    def setUp(self):
+        EthnologueLanguageIndex.objects.bulk_create([
+            EthnologueLanguageIndex(language_code="k{0:02d}".format(i), country_code="KK", name_type="L", name=u"Nàme {0}".format(i % 5))
+            for i in range(30)
+        ])
+
+    def fetch(self, start, search=""):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("ajax_ds_ethnologue_language_index"), {
+                "draw": "1", "start": str(start), "length": "10", "search[value]": search,
+                "order[0][column]": "3", "order[0][dir]": "desc"
+            })
+        rows = [row[0] for row in json.loads(response.content)["data"]]
+        return rows, [q["sql"] for q in queries if "ethnologuelanguageindex" in q["sql"] and "COUNT" not in q["sql"]]
+
+    def test_pages_seek_from_previous_page(self):
+        expected = list(EthnologueLanguageIndex.objects.order_by("-name", "-pk").values_list("language_code", flat=True))
+        rows = []
+        for start in [0, 10, 20]:
+            page, queries = self.fetch(start)
+            rows.extend(page)
+            self.assertNotIn("OFFSET", queries[0])
+        self.assertEquals(rows, expected)
+
+    def test_unknown_start_falls_back_to_offset(self):
+        page, queries = self.fetch(20, u"nàme")
+        self.assertIn("OFFSET", queries[0])
+        self.assertEquals(len(page), 10)
@@ -1,14 +1,24 @@
+import json
 import os
+import shutil
+import tempfile
 
-from django.test import TestCase
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
 
 from pinax.eventlog.models import Log
-from mock import patch
+from mock import Mock, patch
 
+from .. import fetch
 from ..models import (
     EthnologueCountryCode,
     EthnologueLanguageCode,
     EthnologueLanguageIndex,
+    ImportSource,
     SIL_ISO_639_3,
     WikipediaISOLanguage,
     WikipediaISOCountry,
@@ -16,7 +26,26 @@ from ..models import (
 )
 
 
-class BaseReloadTestMixin(object):
+class TemporarySnapshotsMixin(object):
+    """
+    Keeps the snapshots a test case's reloads store out of the real store
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.snapshot_root = tempfile.mkdtemp()
+        cls.snapshot_settings = override_settings(IMPORTS_SNAPSHOT_ROOT=cls.snapshot_root)
+        cls.snapshot_settings.enable()
+        super(TemporarySnapshotsMixin, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TemporarySnapshotsMixin, cls).tearDownClass()
+        cls.snapshot_settings.disable()
+        shutil.rmtree(cls.snapshot_root)
+
+
+class BaseReloadTestMixin(TemporarySnapshotsMixin):
     ModelClass = None
     filename = ""
     expected_success_count = 0
@@ -36,6 +65,7 @@ class BaseReloadTestMixin(object):
     def test_reload(self):
         with patch("requests.Session", create=True) as mock_requests:
             mock_requests.get().status_code = 200
+            mock_requests.get().headers = {}
             mock_requests.get().content = self.data
             self.ModelClass.reload(mock_requests)
             self.assertEquals(self.ModelClass.objects.count(), self.expected_success_count)
@@ -43,14 +73,20 @@ class BaseReloadTestMixin(object):
     def test_reload_no_content(self):
         with patch("requests.Session") as mock_requests:
             mock_requests.get().status_code = 200
+            mock_requests.get().headers = {}
             mock_requests.get().content = ""
             self.assertEquals(self.ModelClass.objects.count(), 0)
             self.ModelClass.reload(mock_requests)
             self.assertEquals(self.ModelClass.objects.count(), 0)
+            source = ImportSource.objects.get(name=self.ModelClass.fetcher_class.__name__)
+            self.assertEquals(source.status_code, 200)
+            self.assertIsNotNone(source.checked_at)
+            self.assertTrue(Log.objects.filter(action=self.log_reload_failed_action).exists())
 
     def test_reload_bad_response(self):
         with patch("requests.Session") as mock_requests:
             mock_requests.get().status_code = 500
+            mock_requests.get().headers = {}
             mock_requests.get().content = ""
             self.assertEquals(self.ModelClass.objects.count(), 0)
             self.ModelClass.reload(mock_requests)
@@ -111,3 +147,231 @@ class IMBPeopleGroupReloadTests(BaseReloadTestMixin, TestCase):
     filename = "imb_people_groups.xls"
     expected_success_count = 42
     log_reload_failed_action = "SOURCE_IMB_PEOPLE_GROUPS_RELOAD_FAILED"
+
+
+class ReloadEngineTests(TemporarySnapshotsMixin, TestCase):
+
+    def reload(self, ModelClass, content):
+        with patch("requests.Session") as mock_requests:
+            mock_requests.get().status_code = 200
+            mock_requests.get().headers = {}
+            mock_requests.get().content = content
+            ModelClass.reload(mock_requests)
+        return Log.objects.filter(action__endswith="RELOADED").latest("pk").extra
+
+    def test_diff_counts(self):
+        header = "Id\tPart2B\tPart2T\tPart1\tScope\tLanguage_Type\tRef_Name\tComment\n"
+        counts = self.reload(SIL_ISO_639_3, header + "aar\taar\taar\taa\tI\tL\tAfar\nkmg\t\t\t\tI\tL\tK\xc3\xa2te\n")
+        self.assertEquals(counts["rows_created"], 2)
+        SIL_ISO_639_3.objects.filter(code="aar").update(ref_name="Afar (old)")
+        ImportSource.objects.filter(name="ISO_639_3Fetcher").update(content_hash="")
+        counts = self.reload(SIL_ISO_639_3, header + "aar\taar\taar\taa\tI\tL\tAfar\nkmg\t\t\t\tI\tL\tK\xc3\xa2te\n")
+        self.assertEquals((counts["rows-updated"], counts["rows_unchanged"]), (1, 1))
+        counts = self.reload(SIL_ISO_639_3, header + "aar\taar\taar\taa\tI\tL\tAfar (Qafar)\nzzj\t\t\t\tI\tL\tZhuang\n")
+        self.assertEquals((counts["rows_created"], counts["rows-updated"], counts["rows_deleted"]), (1, 1, 1))
+        self.assertEquals(
+            sorted(SIL_ISO_639_3.objects.values_list("code", "ref_name")),
+            [(u"aar", u"Afar (Qafar)"), (u"zzj", u"Zhuang")]
+        )
+
+    def test_staged_reload(self):
+        data = open(os.path.join(os.path.dirname(__file__), "data", "LanguageIndex.tab")).read()
+        counts = self.reload(EthnologueLanguageIndex, data)
+        total = EthnologueLanguageIndex.objects.count()
+        self.assertEquals(counts["rows_created"], total)
+        lines = data.splitlines(True)
+        counts = self.reload(EthnologueLanguageIndex, "".join(lines[:-1]) + "zzz\tZZ\tL\tZ Test\n")
+        self.assertEquals((counts["rows_created"], counts["rows_deleted"]), (1, 1))
+        self.assertEquals(EthnologueLanguageIndex.objects.count(), total)
+        self.assertTrue(EthnologueLanguageIndex.objects.filter(language_code="zzz", name="Z Test").exists())
+
+
+class ConditionalFetchTests(TemporarySnapshotsMixin, TestCase):
+
+    header = "Id\tPart2B\tPart2T\tPart1\tScope\tLanguage_Type\tRef_Name\tComment\n"
+
+    def reload(self, status_code=200, content="", headers=None):
+        with patch("requests.Session") as mock_requests:
+            mock_requests.get().status_code = status_code
+            mock_requests.get().headers = headers or {}
+            mock_requests.get().content = content
+            SIL_ISO_639_3.reload(mock_requests)
+        return mock_requests.get.call_args[1]["headers"]
+
+    def test_validators_sent_and_stored(self):
+        self.assertEquals(self.reload(content=self.header + "aar\taar\taar\taa\tI\tL\tAfar\n", headers={
+            "ETag": '"abc"', "Last-Modified": "Wed, 01 Jul 2015 00:00:00 GMT"
+        }), {})
+        source = ImportSource.objects.get(name="ISO_639_3Fetcher")
+        self.assertEquals((source.etag, source.status_code), ('"abc"', 200))
+        self.assertEquals(len(source.content_hash), 40)
+        self.assertEquals(self.reload(status_code=304), {
+            "If-None-Match": '"abc"', "If-Modified-Since": "Wed, 01 Jul 2015 00:00:00 GMT"
+        })
+        self.assertEquals(ImportSource.objects.get(name="ISO_639_3Fetcher").status_code, 304)
+        self.assertEquals(SIL_ISO_639_3.objects.count(), 1)
+
+    def test_unchanged_content_skips_load(self):
+        content = self.header + "aar\taar\taar\taa\tI\tL\tAfar\n"
+        self.reload(content=content)
+        loads = Log.objects.filter(action="SOURCE_SIL_ISO_639_3_RELOADED").count()
+        SIL_ISO_639_3.objects.all().delete()
+        self.reload(content=content)
+        self.assertEquals(Log.objects.filter(action="SOURCE_SIL_ISO_639_3_RELOADED").count(), loads)
+        self.assertEquals(SIL_ISO_639_3.objects.count(), 0)
+
+
+class ReloadImportsCommandTests(TemporarySnapshotsMixin, TestCase):
+
+    def setUp(self):
+        super(ReloadImportsCommandTests, self).setUp()
+        # Mock's call_count can lose increments made from the download threads
+        self.requested = []
+
+    def get(self, url, headers):
+        self.requested.append(url)
+        if url == fetch.ISO_639_3Fetcher.url:
+            content = "Id\tPart2B\tPart2T\tPart1\tScope\tLanguage_Type\tRef_Name\tComment\naar\taar\taar\taa\tI\tL\tAfar\n"
+            return Mock(status_code=200, headers={"ETag": '"x"'}, content=content)
+        return Mock(status_code=304, headers={}, content="")
+
+    def call_command(self, **options):
+        out = StringIO()
+        with patch("td.imports.management.commands.reload_imports.requests.Session") as Session, \
+                patch("td.imports.management.commands.reload_imports.update_countries_from_imports") as countries, \
+                patch("td.imports.management.commands.reload_imports.integrate_imports") as integrate:
+            Session.return_value.get.side_effect = self.get
+            call_command("reload_imports", stdout=out, **options)
+        self.assertTrue(countries.called and integrate.called)
+        return Session, out.getvalue().splitlines()
+
+    def test_downloads_then_loads(self):
+        Session, lines = self.call_command(workers=3)
+        self.assertEquals(len(self.requested), 7)
+        self.assertEquals(SIL_ISO_639_3.objects.count(), 1)
+        self.assertEquals(ImportSource.objects.get(name="ISO_639_3Fetcher").etag, '"x"')
+        self.assertEquals(len([x for x in lines if "(nothing new)" in x]), 6)
+        self.assertTrue(lines[-1].startswith("Fetched 7 sources"))
+
+    def test_replay_from_snapshot(self):
+        self.call_command()
+        SIL_ISO_639_3.objects.all().delete()
+        Session, lines = self.call_command(from_snapshot=True)
+        self.assertFalse(Session.return_value.get.called)
+        self.assertEquals(SIL_ISO_639_3.objects.count(), 1)
+        self.assertEquals(len([x for x in lines if "skipped" in x]), 6)
+        load = ImportSource.objects.get(name="ISO_639_3Fetcher").loads.first()
+        self.assertTrue(load.replayed)
+        self.assertEquals(ImportSource.objects.get(name="ISO_639_3Fetcher").etag, "")
+
+
+class BenchmarkCommandTests(TestCase):
+
+    def test_report(self):
+        out = StringIO()
+        call_command("benchmark_imports", stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEquals([x["stage"] for x in report["stages"]][-3:], [
+            "IMBPeopleGroup.reload", "update_countries_from_imports", "integrate_imports"
+        ])
+        index = report["stages"][5]
+        self.assertEquals(index["stage"], "EthnologueLanguageIndex.reload")
+        self.assertTrue(index["rows"] > 50000)
+        self.assertTrue(index["queries"] > 0)
+        self.assertTrue(index["process_peak_rss_kb"] > 0)
+        self.assertFalse(report["kept"])
+        # the run is rolled back
+        self.assertEquals(EthnologueLanguageIndex.objects.count(), 0)
+
+
+class FakeSheet(object):
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.nrows = len(rows)
+
+    def row_values(self, row, start_colx=0, end_colx=None):
+        return self.rows[row][start_colx:end_colx]
+
+
+class IMBWorkbookTests(TestCase):
+
+    def test_finds_shifted_header(self):
+        sheet = FakeSheet([
+            ["Listing of People Groups", "", "", ""],
+            ["", "", "", ""],
+            ["", "PEID", "Country", ""],
+            ["", 1.0, "Chad", ""],
+            ["", 2.0, "Niger", ""],
+            ["", "", "", ""],
+            ["", "Totals", "", ""],
+        ])
+        self.assertEquals(IMBPeopleGroup.find_header(sheet), (2, 1))
+        columns, rows = IMBPeopleGroup.sheet_rows(sheet)
+        self.assertEquals(columns, ["PEID", "Country"])
+        self.assertEquals(list(rows), [[1.0, "Chad"], [2.0, "Niger"]])
+
+    def test_missing_header(self):
+        with self.assertRaises(ValueError):
+            IMBPeopleGroup.find_header(FakeSheet([["Listing"], [""]]))
+
+    def test_compiled_converter_matches_mapping(self):
+        data = open(os.path.join(os.path.dirname(__file__), "data", "imb_people_groups.xls"), "rb").read()
+        IMBPeopleGroup.load(data)
+        group = IMBPeopleGroup.objects.order_by("peid").first()
+        self.assertTrue(isinstance(group.peid, (int, long)))
+        self.assertTrue(group.evangelical_engagement in [True, False])
+        IMBPeopleGroup.objects.filter(pk=group.pk).update(people_group="Changed")
+        IMBPeopleGroup.load(data)
+        counts = Log.objects.filter(action="SOURCE_IMB_PEOPLE_GROUPS_LOADED").latest("pk").extra
+        self.assertEquals((counts["rows-updated"], counts["rows_unchanged"]), (1, 41))
+
+
+class SnapshotStoreTests(TemporarySnapshotsMixin, TestCase):
+
+    def test_content_addressed(self):
+        content_hash = fetch.store_snapshot("abc")
+        self.assertEquals(content_hash, "a9993e364706816aba3e25717850c26c9cd0d89d")
+        self.assertEquals(fetch.store_snapshot("abc"), content_hash)
+        self.assertEquals(fetch.read_snapshot(content_hash), "abc")
+        self.assertEquals(os.listdir(os.path.join(self.snapshot_root, "a9")), [content_hash])
+
+    def test_missing_snapshot(self):
+        with self.assertRaises(fetch.SnapshotMissing):
+            fetch.read_snapshot("0" * 40)
+        with self.assertRaises(fetch.SnapshotMissing):
+            fetch.ISO_639_3Fetcher.replay()
+
+    def test_loads_record_snapshot(self):
+        content = "Id\tPart2B\tPart2T\tPart1\tScope\tLanguage_Type\tRef_Name\tComment\naar\taar\taar\taa\tI\tL\tAfar\n"
+        with patch("requests.Session") as mock_requests:
+            mock_requests.get().status_code = 200
+            mock_requests.get().headers = {}
+            mock_requests.get().content = content
+            SIL_ISO_639_3.reload(mock_requests)
+        load = ImportSource.objects.get(name="ISO_639_3Fetcher").loads.get()
+        self.assertFalse(load.replayed)
+        self.assertEquals(fetch.read_snapshot(load.content_hash), content)
+        SIL_ISO_639_3.objects.all().delete()
+        self.assertTrue(SIL_ISO_639_3.replay(load.content_hash))
+        self.assertEquals(SIL_ISO_639_3.objects.count(), 1)
+
+    def test_prune_keeps_recent_loads(self):
+        source = ImportSource.objects.create(name="TestFetcher", content_hash=fetch.store_snapshot("current"))
+        hashes = [fetch.store_snapshot("load {0}".format(i)) for i in range(fetch.SNAPSHOT_RETENTION + 2)]
+        for i, content_hash in enumerate(hashes):
+            source.loads.create(content_hash=content_hash, loaded_at=timezone.now() - timedelta(days=i))
+        unreferenced = fetch.store_snapshot("failed load")
+        with patch("td.imports.fetch.SNAPSHOT_GRACE", -60):
+            fetch.prune_snapshots()
+        self.assertEquals(fetch.read_snapshot(source.content_hash), "current")
+        for i, content_hash in enumerate(hashes[:fetch.SNAPSHOT_RETENTION]):
+            self.assertEquals(fetch.read_snapshot(content_hash), "load {0}".format(i))
+        for content_hash in hashes[fetch.SNAPSHOT_RETENTION:] + [unreferenced]:
+            with self.assertRaises(fetch.SnapshotMissing):
+                fetch.read_snapshot(content_hash)
+
+    def test_prune_keeps_young_snapshots(self):
+        content_hash = fetch.store_snapshot("in progress")
+        fetch.prune_snapshots()
+        self.assertEquals(fetch.read_snapshot(content_hash), "in progress")
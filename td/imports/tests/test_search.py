@@ -0,0 +1,59 @@
+import json
+from unittest import skipUnless
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from td.utils import ContainsSearch, DataTableSourceView, TrigramSearch
+from td.views import AjaxSIL_ISO_639_3ListView
+
+from ..models import SIL_ISO_639_3
+
+
+class SearchBackendTests(TestCase):
+
+    def setUp(self):
+        for code, name, comment in [
+            ("aaa", "Alpha", ""),
+            ("bbb", "Beta 50%", "see alpha"),
+            ("ccc", "Gamma", ""),
+            ("ddd", u"G\xe0mma", "")
+        ]:
+            SIL_ISO_639_3.objects.create(code=code, ref_name=name, comment=comment, scope="I", language_type="L")
+
+    def search(self, backend, term):
+        class View(DataTableSourceView):
+            model = SIL_ISO_639_3
+            fields = AjaxSIL_ISO_639_3ListView.fields
+            search_backend = backend
+            search_term = term
+        view = View()
+        return sorted(view.search_backend(view).filter(view.queryset).values_list("code", flat=True))
+
+    def test_backends_agree(self):
+        for term in ["alpha", "ALP", "50%", "a_", "Gam", "i", "zzz"]:
+            self.assertEquals(self.search(TrigramSearch, term), self.search(ContainsSearch, term), term)
+        self.assertEquals(self.search(TrigramSearch, "alpha"), ["aaa", "bbb"])
+
+    def test_non_ascii_term(self):
+        self.assertEquals(self.search(TrigramSearch, u"g\xe0m"), ["ddd"])
+        self.assertEquals(self.search(TrigramSearch, u"g\xe0m"), self.search(ContainsSearch, u"g\xe0m"))
+
+    def test_term_does_not_span_fields(self):
+        self.assertEquals(self.search(TrigramSearch, "alphai"), [])
+
+    @skipUnless(connection.vendor == "postgresql", "TrigramSearch falls back to ContainsSearch")
+    def test_one_predicate(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search(TrigramSearch, "alpha")
+        self.assertEquals(queries[0]["sql"].lower().count(" like "), 1)
+
+    def test_view(self):
+        response = self.client.get(reverse("ajax_ds_sil"), {
+            "draw": "1", "start": "0", "length": "10", "search[value]": "beta",
+            "order[0][column]": "0", "order[0][dir]": "asc"
+        })
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([row[0] for row in json.loads(response.content)["data"]], ["bbb"])
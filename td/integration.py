@@ -0,0 +1,467 @@
+import hashlib
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.utils.encoding import force_text
+
+from td.imports.models import (
+    EthnologueCountryCode,
+    EthnologueLanguageCode,
+    IMBPeopleGroup,
+    SIL_ISO_639_3,
+    WikipediaISOCountry,
+    WikipediaISOLanguage
+)
+
+from .models import (
+    AdditionalLanguage,
+    Country,
+    CountryEAV,
+    Language,
+    LanguageEAV,
+    LanguageFingerprint,
+    Region
+)
+from .utils import bulk_update
+from .resources.models import Media, Resource, Title
+
+
+MERGED_LANGUAGES_SQL = """
+select coalesce(nullif(x.part_1, ''), x.code) as code,
+       coalesce(nullif(nn1.native_name, ''), nullif(nn2.native_name, ''), x.ref_name) as name,
+       coalesce(nullif(nn1.language_name, ''), nn2.language_name, lc.name, '') as anglicized_name,
+       coalesce(cc.code, ''),
+       nullif(nn1.native_name, '') as nn1name,
+       nn1.id,
+       nullif(nn2.native_name, '') as nn2name,
+       nn2.id,
+       x.ref_name as xname,
+       x.id,
+       x.code as iso_639_3
+  from imports_sil_iso_639_3 x
+left join imports_ethnologuelanguagecode lc on x.code = lc.code
+left join imports_wikipediaisolanguage nn1 on x.part_1 = nn1.iso_639_1
+left join imports_wikipediaisolanguage nn2 on x.code = nn2.iso_639_3
+left join imports_ethnologuecountrycode cc on lc.country_code = cc.code
+ where lc.status = %s or lc.status is NULL order by code;
+"""
+
+# Fields the integration writes; they are also what the entity tracker would
+# have recorded as attributes when saving with a source set
+NAME_FIELDS = ["name", "anglicized_name", "iso_639_3"]
+COUNTRY_FIELDS = ["country_id"]
+LANGUAGE_FIELDS = NAME_FIELDS + COUNTRY_FIELDS
+
+COUNTRY_SOURCE_FIELDS = ["name", "region_id"]
+COUNTRY_RECONCILED_FIELDS = COUNTRY_SOURCE_FIELDS + ["alpha_3_code"]
+
+# IMB flag: (title slug, title name, media slug, media name)
+IMB_RESOURCES = {
+    "bible_stories": ("onestory-bible-stories", "OneStory Bible Storires", "audio", "Audio"),
+    "jesus_film": ("jesus-film", "The Jesus Film", "video", "Video"),
+    "gospel_recording": ("gospel-recording-grn", "Gospel Recording (GRN)", "audio", "Audio"),
+    "radio_broadcast": ("radio-broadcast-twr-febc", "Radio Broadcast (TWR/FEBC)", "audio", "Audio"),
+    "written_scripture": ("bible-portions", "Bible (Portions)", "print", "Print")
+}
+
+# The merged row columns a language's integrated state depends on: code,
+# name, anglicized name, country code and ISO-639-3. Source row ids are left
+# out, as the Wikipedia tables get new ones on every reload. The country the
+# code resolves to is hashed along with them.
+FINGERPRINT_COLUMNS = [0, 1, 2, 3, 10]
+
+
+def merged_language_rows():
+    """
+    Return the merged SIL, Ethnologue, Wikipedia and additional language rows
+    the integration works from, sorted by code
+    """
+    cursor = connection.cursor()
+    cursor.execute(MERGED_LANGUAGES_SQL, [EthnologueLanguageCode.STATUS_LIVING])
+    rows = cursor.fetchall()
+    rows.extend([
+        (
+            x.merge_code(), x.merge_name(), x.native_name, None, "", None, "",
+            None, "!ADDL", x.id, x.three_letter
+        )
+        for x in AdditionalLanguage.objects.all()
+    ])
+    rows.sort()
+    return rows
+
+
+def row_source(r):
+    """
+    Return the (model, pk) the name of merged row `r` was taken from
+    """
+    source = None
+    if r[1] == r[4]:
+        source = (WikipediaISOLanguage, r[5])
+    if r[1] == r[6]:
+        source = (WikipediaISOLanguage, r[7])
+    if r[1] == r[8]:
+        source = (SIL_ISO_639_3, r[9])
+    if r[8] == "!ADDL":
+        source = (AdditionalLanguage, r[9])
+    return source
+
+
+def fingerprints(rows, countries):
+    """
+    Return a hash of the merged rows of each language code, over the columns
+    its integration depends on and the pk its country code resolves to in
+    `countries`, so a language is looked at again once its country exists
+    """
+    hashes = {}
+    for r in rows:
+        if r[0] is not None:
+            values = [r[i] for i in FINGERPRINT_COLUMNS] + [countries.get(r[3])]
+            hashes.setdefault(r[0], hashlib.sha1()).update(json.dumps(values))
+    return {code: x.hexdigest() for code, x in hashes.items()}
+
+
+def changed_codes(hashes):
+    """
+    Return the codes whose fingerprint differs from the one stored by their
+    last integration, or that have no language yet
+    """
+    stored = dict(LanguageFingerprint.objects.values_list("code", "fingerprint"))
+    present = set(Language.objects.values_list("code", flat=True))
+    return set(code for code, x in hashes.items() if stored.get(code) != x or code not in present)
+
+
+def store_fingerprints(hashes, codes, batch_size=500):
+    """
+    Store the fingerprints of `codes` from `hashes`, and drop those of codes
+    that are no longer in the merged rows, so one that comes back is looked
+    at again rather than compared to what it was before it left
+    """
+    gone = sorted(set(LanguageFingerprint.objects.values_list("code", flat=True)) - set(hashes))
+    for start in range(0, len(gone), batch_size):
+        LanguageFingerprint.objects.filter(code__in=gone[start:start + batch_size]).delete()
+    codes = sorted(codes)
+    for start in range(0, len(codes), batch_size):
+        batch = codes[start:start + batch_size]
+        LanguageFingerprint.objects.filter(code__in=batch).delete()
+        LanguageFingerprint.objects.bulk_create([LanguageFingerprint(code=x, fingerprint=hashes[x]) for x in batch])
+
+
+class AttributeRecorder(object):
+    """
+    Collects the EAV attributes `td.resources.receivers.handle_entity_save`
+    would have created had each change been saved with its source set, so
+    they can be written in one batch.
+    """
+
+    def __init__(self, eav_model, attributes):
+        self.eav_model = eav_model
+        self.attributes = attributes
+        self.pending = []
+
+    def record(self, key, before, after, fields, source):
+        if source is None:
+            return
+        source_ct = ContentType.objects.get_for_model(source[0])
+        for field in fields:
+            if before[field] != after[field]:
+                value = force_text(after[field] or "")
+                self.pending.append((key, field, value, source_ct.pk, source[1]))
+
+    def save(self, pks):
+        """
+        Write the recorded attributes, resolving entity keys through `pks`
+        and skipping any that already exist
+        """
+        seen = set(
+            self.eav_model.objects.filter(
+                attribute__in=self.attributes,
+                entity_id__in=set(pks[x[0]] for x in self.pending)
+            ).values_list("entity_id", "attribute", "value", "source_ct_id", "source_id")
+        ) if self.pending else set()
+        records = []
+        for key, attribute, value, source_ct_id, source_id in self.pending:
+            identity = (pks[key], attribute, value, source_ct_id, source_id)
+            if identity not in seen:
+                seen.add(identity)
+                records.append(self.eav_model(
+                    entity_id=pks[key],
+                    attribute=attribute,
+                    value=value,
+                    source_ct_id=source_ct_id,
+                    source_id=source_id
+                ))
+        self.eav_model.objects.bulk_create(records, batch_size=500)
+        self.pending = []
+        return len(records)
+
+
+def new_language_state(code):
+    return dict(pk=None, code=code, name="", anglicized_name="", iso_639_3="", country_id=None)
+
+
+def apply_language_row(state, r, countries, ecountries, recorder):
+    """
+    Apply merged row `r` to the in-memory `state` of its language the way
+    the per-row integration used to: names first, then the country.
+    """
+    before = dict(state)
+    state["name"] = r[1]
+    state["anglicized_name"] = r[2]
+    if r[10] != "":
+        state["iso_639_3"] = r[10]
+    recorder.record(r[0], before, state, NAME_FIELDS, row_source(r))
+    if r[3]:
+        before = dict(state)
+        state["country_id"] = countries.get(r[3])
+        recorder.record(r[0], before, state, COUNTRY_FIELDS, (EthnologueCountryCode, ecountries[r[3]]))
+
+
+def diff_languages(rows, recorder, countries):
+    """
+    Compute the final state of every language touched by `rows` against the
+    existing table, with `countries` mapping country codes to pks. Returns
+    `(states, existing)`, both keyed by code.
+    """
+    ecountries = dict(EthnologueCountryCode.objects.values_list("code", "pk"))
+    existing = {
+        x["code"]: x
+        for x in Language.objects.filter(code__in=set(r[0] for r in rows)).values("pk", "code", *LANGUAGE_FIELDS)
+    }
+    states = {}
+    for r in rows:
+        if r[0] is None:
+            continue
+        if r[0] not in states:
+            states[r[0]] = dict(existing[r[0]]) if r[0] in existing else new_language_state(r[0])
+        apply_language_row(states[r[0]], r, countries, ecountries, recorder)
+    return states, existing
+
+
+def integrate_languages(rows, full=False):
+    """
+    Integrate merged source rows into `Language` with batched writes: new
+    languages are bulk inserted, changed ones updated in batches and
+    unchanged ones left alone. Unless `full` is set, only languages whose
+    source rows changed since their last integration are looked at.
+    Returns the created, updated, unchanged and skipped counts and the codes
+    of the languages written.
+    """
+    countries = dict(Country.objects.values_list("code", "pk"))
+    hashes = fingerprints(rows, countries)
+    codes = set(hashes) if full else changed_codes(hashes)
+    rows = [r for r in rows if r[0] in codes]
+    recorder = AttributeRecorder(LanguageEAV, LANGUAGE_FIELDS)
+    states, existing = diff_languages(rows, recorder, countries)
+    created = [x for code, x in states.items() if code not in existing]
+    updated = [x for code, x in states.items() if code in existing and x != existing[code]]
+    Language.objects.bulk_create(
+        [Language(**{f: x[f] for f in ["code"] + LANGUAGE_FIELDS}) for x in created],
+        batch_size=500
+    )
+    bulk_update(Language, updated, LANGUAGE_FIELDS)
+    pks = {code: x["pk"] for code, x in existing.items()}
+    pks.update(Language.objects.filter(code__in=[x["code"] for x in created]).values_list("code", "pk"))
+    store_fingerprints(hashes, codes)
+    counts = {
+        "created": len(created),
+        "updated": len(updated),
+        "unchanged": len(states) - len(created) - len(updated),
+        "skipped": len(hashes) - len(codes),
+        "attributes": recorder.save(pks)
+    }
+    return counts, sorted(x["code"] for x in created + updated)
+
+
+def new_country_state(code):
+    return dict(pk=None, code=code, name="", region_id=None, alpha_3_code="")
+
+
+def diff_countries(recorder):
+    """
+    Compute the final state of every country the Ethnologue and Wikipedia
+    country imports touch, the way saving each in turn used to: Ethnologue
+    sets the name and region, Wikipedia the alpha-3 code and, for countries
+    it creates, the name. Returns `(states, existing)`, both keyed by code.
+    """
+    regions = {}
+    for pk, name in Region.objects.order_by("pk").values_list("pk", "name"):
+        regions.setdefault(name, pk)
+    existing = {
+        x["code"]: x
+        for x in Country.objects.values("pk", "code", *COUNTRY_RECONCILED_FIELDS)
+    }
+    states = {}
+    for ecountry in EthnologueCountryCode.objects.order_by("pk").values("pk", "code", "name", "area"):
+        code = ecountry["code"]
+        if code not in states:
+            states[code] = dict(existing[code]) if code in existing else new_country_state(code)
+        before = dict(states[code])
+        states[code].update(region_id=regions.get(ecountry["area"]), name=ecountry["name"])
+        recorder.record(code, before, states[code], COUNTRY_SOURCE_FIELDS, (EthnologueCountryCode, ecountry["pk"]))
+    for wcountry in WikipediaISOCountry.objects.order_by("pk").values("alpha_2", "alpha_3", "english_short_name"):
+        code = wcountry["alpha_2"]
+        if code not in states:
+            states[code] = dict(existing[code]) if code in existing else dict(
+                new_country_state(code), name=wcountry["english_short_name"]
+            )
+        states[code]["alpha_3_code"] = wcountry["alpha_3"]
+    return states, existing
+
+
+def country_changes(before, after):
+    return {
+        f: [before[f], after[f]]
+        for f in COUNTRY_RECONCILED_FIELDS
+        if before[f] != after[f]
+    }
+
+
+def reconcile_countries():
+    """
+    Bring `Country` in line with the imported country lists with batched
+    writes, recording the Ethnologue provenance of names and regions as
+    attributes. Returns a report of the countries created and the fields
+    changed on the ones updated.
+    """
+    recorder = AttributeRecorder(CountryEAV, COUNTRY_SOURCE_FIELDS)
+    states, existing = diff_countries(recorder)
+    created = [x for code, x in sorted(states.items()) if code not in existing]
+    updated = [x for code, x in sorted(states.items()) if code in existing and x != existing[code]]
+    Country.objects.bulk_create(
+        [Country(**{f: x[f] for f in ["code"] + COUNTRY_RECONCILED_FIELDS}) for x in created],
+        batch_size=500
+    )
+    bulk_update(Country, updated, COUNTRY_RECONCILED_FIELDS)
+    pks = {code: x["pk"] for code, x in existing.items()}
+    pks.update(Country.objects.filter(code__in=[x["code"] for x in created]).values_list("code", "pk"))
+    return {
+        "created": [x["code"] for x in created],
+        "updated": {x["code"]: country_changes(existing[x["code"]], x) for x in updated},
+        "unchanged": len(states) - len(created) - len(updated),
+        "attributes": recorder.save(pks)
+    }
+
+
+class LanguageResolver(object):
+    """
+    Resolves an IMB ROL code to a language the way looking it up by
+    ISO-639-3 and then by code did, from indexes built in one query
+    """
+
+    def __init__(self):
+        self.by_iso = {}
+        self.by_code = {}
+        self.country_ids = {}
+        for pk, code, iso_639_3, country_id in Language.objects.order_by("pk").values_list(
+            "pk", "code", "iso_639_3", "country_id"
+        ):
+            if iso_639_3:
+                self.by_iso.setdefault(iso_639_3, pk)
+            self.by_code[code] = pk
+            self.country_ids[pk] = country_id
+
+    def resolve(self, rol):
+        return self.by_iso.get(rol, self.by_code.get(rol))
+
+
+def slug_objects(model, specs):
+    """
+    Return a map of slug to pk for the `(slug, name)` pairs in `specs`,
+    creating any that do not exist yet
+    """
+    pks = {}
+    for pk, slug in model.objects.filter(slug__in=[x[0] for x in specs]).order_by("pk").values_list("pk", "slug"):
+        pks.setdefault(slug, pk)
+    missing = dict((slug, name) for slug, name in specs if slug not in pks)
+    if missing:
+        model.objects.bulk_create([model(slug=slug, name=name) for slug, name in missing.items()])
+        pks.update(model.objects.filter(slug__in=missing).values_list("slug", "pk"))
+    return pks
+
+
+def imb_resource_links(resolver):
+    """
+    Return the `(language pk, title slug, media slug)` links the flags of
+    the IMB people groups call for, taking one group per IMB language
+    """
+    links = set()
+    seen = set()
+    for imb in IMBPeopleGroup.objects.order_by("language", "peid").values(
+        "language", "rol", *IMB_RESOURCES.keys()
+    ).iterator():
+        # the first group by peid stands for its language
+        if imb["language"] in seen:
+            continue
+        seen.add(imb["language"])
+        language_id = resolver.resolve(imb["rol"])
+        if language_id is not None:
+            links.update(
+                (language_id, spec[0], spec[2])
+                for flag, spec in IMB_RESOURCES.items()
+                if imb[flag]
+            )
+    return links
+
+
+def integrate_imb_resources(resolver):
+    """
+    Create the published resources and media links the IMB people groups
+    call for with bulk inserts. Returns the created and published counts.
+    """
+    links = imb_resource_links(resolver)
+    # only the titles and media some flag links to are looked up or created
+    linked_titles = set(x[1] for x in links)
+    linked_medias = set(x[2] for x in links)
+    titles = slug_objects(Title, set((x[0], x[1]) for x in IMB_RESOURCES.values() if x[0] in linked_titles))
+    medias = slug_objects(Media, set((x[2], x[3]) for x in IMB_RESOURCES.values() if x[2] in linked_medias))
+    wanted = set((language_id, titles[title]) for language_id, title, _ in links)
+    existing = {
+        (x["language_id"], x["title_id"]): x
+        for x in Resource.objects.filter(title_id__in=titles.values()).values(
+            "pk", "language_id", "title_id", "published_flag"
+        )
+    }
+    created = [Resource(language_id=x[0], title_id=x[1], published_flag=True) for x in wanted if x not in existing]
+    Resource.objects.bulk_create(created, batch_size=500)
+    unpublished = [existing[x]["pk"] for x in wanted if x in existing and not existing[x]["published_flag"]]
+    Resource.objects.filter(pk__in=unpublished).update(published_flag=True)
+    resources = {
+        (language_id, title_id): pk
+        for pk, language_id, title_id in Resource.objects.filter(title_id__in=titles.values()).values_list(
+            "pk", "language_id", "title_id"
+        )
+    } if created else {key: x["pk"] for key, x in existing.items()}
+    through = Resource.medias.through
+    linked = set(through.objects.filter(resource__title_id__in=titles.values()).values_list("resource_id", "media_id"))
+    new_links = set(
+        (resources[(language_id, titles[title])], medias[media])
+        for language_id, title, media in links
+    ) - linked
+    through.objects.bulk_create([through(resource_id=r, media_id=m) for r, m in new_links], batch_size=500)
+    return {"resources_created": len(created), "resources_published": len(unpublished), "media_links": len(new_links)}
+
+
+def integrate_imb_countries(resolver):
+    """
+    Set the country of each language from the IMB people groups by country
+    name, the last group of a language winning, with the IMB provenance the
+    per-row saves recorded. Returns the updated and attribute counts.
+    """
+    countries = {}
+    for pk, name in Country.objects.order_by("pk").values_list("pk", "name"):
+        countries.setdefault(name, pk)
+    recorder = AttributeRecorder(LanguageEAV, COUNTRY_FIELDS)
+    states = {}
+    for imb in IMBPeopleGroup.objects.order_by("language", "peid").values("peid", "rol", "country"):
+        language_id = resolver.resolve(imb["rol"])
+        country_id = countries.get(imb["country"])
+        if language_id is None or country_id is None:
+            continue
+        state = states.setdefault(language_id, dict(pk=language_id, country_id=resolver.country_ids[language_id]))
+        before = dict(state)
+        state["country_id"] = country_id
+        recorder.record(language_id, before, state, COUNTRY_FIELDS, (IMBPeopleGroup, imb["peid"]))
+    updated = [x for pk, x in states.items() if x["country_id"] != resolver.country_ids[pk]]
+    bulk_update(Language, updated, COUNTRY_FIELDS)
+    return {"languages_updated": len(updated), "attributes": recorder.save({pk: pk for pk in states})}
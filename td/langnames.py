@@ -0,0 +1,259 @@
+import bisect
+import hashlib
+import json
+import time
+
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.text import compress_string
+
+from . import caching
+
+
+GENERATION = "langnames"
+STORE_KEY = "langnames_store"
+PATCH_LOCK_KEY = "langnames_store_lock"
+PATCH_LOCK_TIMEOUT = 30
+PATCH_LOCK_ATTEMPTS = 20
+PATCH_LOCK_WAIT = 0.05  # seconds
+# a rebuild waits out a patch for as long as the lock can be held
+REBUILD_LOCK_ATTEMPTS = int(PATCH_LOCK_TIMEOUT / PATCH_LOCK_WAIT)
+
+
+def get_generation():
+    return caching.get_generation(GENERATION)
+
+
+def bump_generation():
+    """
+    Mark the cached langnames data as changed so per-worker structures built
+    from it (e.g. the autocomplete index) are rebuilt on next use.
+    """
+    return caching.bump_now(GENERATION)
+
+
+def flatten(store):
+    return sorted(store.values(), key=lambda x: x["lc"])
+
+
+def render_codes_text(data):
+    return b" ".join(force_bytes(x["lc"]) for x in data)
+
+
+def render_names_text(data):
+    return b"\n".join(force_bytes(x["lc"]) + b"\t" + force_bytes(x["ln"]) for x in data)
+
+
+def render_names_json(data):
+    return force_bytes(json.dumps(data, cls=DjangoJSONEncoder))
+
+
+EXPORTS = {
+    "codes-d43.txt": render_codes_text,
+    "langnames.txt": render_names_text,
+    "langnames.json": render_names_json,
+}
+
+
+def export_key(name):
+    return "langnames_export:{0}".format(name)
+
+
+def export_meta_key(name):
+    return "langnames_export_meta:{0}".format(name)
+
+
+def get_export_meta(name):
+    """
+    Return the ETag and Last-Modified of a pre-rendered export without
+    loading its payload, or None when it has not been rendered yet.
+    """
+    return cache.get(export_meta_key(name))
+
+
+def get_export(name):
+    return cache.get(export_key(name))
+
+
+def render_exports(data):
+    """
+    Materialize the plain and gzipped payloads of every export. Last-Modified
+    only moves when an export's content actually changed.
+    """
+    now = timezone.now()
+    for name, render in EXPORTS.items():
+        content = render(data)
+        etag = hashlib.sha1(content).hexdigest()
+        meta = get_export_meta(name)
+        if meta is not None and meta["etag"] == etag:
+            continue
+        cache.set(export_key(name), {"content": content, "gzip": compress_string(content), "etag": etag}, None)
+        cache.set(export_meta_key(name), {"etag": etag, "last_modified": now}, None)
+
+
+def publish(store, generation=None):
+    """
+    Write the keyed store, the flat list and the exports derived from it. The
+    previous list stays readable until it is replaced, so readers never see
+    an empty list during a rebuild. With a `generation`, nothing is written
+    unless the langnames generation still matches it; returns whether the
+    store was written.
+    """
+    data = flatten(store)
+    if generation is not None and get_generation() != generation:
+        return False
+    cache.set(STORE_KEY, store, None)
+    cache.set("langnames", data, None)
+    render_exports(data)
+    bump_generation()
+    return True
+
+
+def acquire_patch_lock(attempts=PATCH_LOCK_ATTEMPTS):
+    for attempt in range(attempts):
+        if cache.add(PATCH_LOCK_KEY, True, PATCH_LOCK_TIMEOUT):
+            return True
+        time.sleep(PATCH_LOCK_WAIT)
+    return False
+
+
+def rebuild(data):
+    """
+    Replace the store with one built from `data`. Holds the patch lock, so a
+    patch in progress cannot write its older copy of the store over this
+    one; returns False when the lock could not be had.
+    """
+    if not acquire_patch_lock(REBUILD_LOCK_ATTEMPTS):
+        return False
+    try:
+        return publish({x["pk"]: x for x in data})
+    finally:
+        cache.delete(PATCH_LOCK_KEY)
+
+
+def patch(pk, entry=None):
+    """
+    Insert or replace the entry for language `pk`, or remove it when `entry`
+    is None. Patches and rebuilds hold a lock around reading and writing
+    the store, so concurrent ones cannot lose each other's edits. Returns
+    False when the store cannot be patched: there is none yet, the lock
+    could not be had, or the store was rebuilt meanwhile. The caller then
+    needs a full rebuild.
+    """
+    if not acquire_patch_lock():
+        return False
+    try:
+        generation = get_generation()
+        store = cache.get(STORE_KEY)
+        if store is None:
+            return False
+        if entry is None:
+            if store.pop(pk, None) is None:
+                return True
+        elif store.get(pk) == entry:
+            return True
+        else:
+            store[pk] = entry
+        return publish(store, generation)
+    finally:
+        cache.delete(PATCH_LOCK_KEY)
+
+
+class LanguageNamesIndex(object):
+    """
+    Search structures over the langnames data used by the autocomplete:
+
+        * a sorted table of lowercased codes for prefix lookups
+        * a map of lowercased country code to entries
+        * trigram posting lists over code, name, anglicized name and region
+
+    Matching follows the original list scans; the index only narrows down
+    which entries have to be looked at.
+    """
+
+    NGRAM_SIZE = 3
+
+    def __init__(self, data, generation=None):
+        self.data = data
+        self.generation = generation
+        self.codes = sorted((force_bytes(x["lc"].lower()), i) for i, x in enumerate(data))
+        self.countries = defaultdict(set)
+        self.texts = []
+        self.ngrams = defaultdict(set)
+        for i, x in enumerate(data):
+            for cc in x["cc"]:
+                self.countries[force_bytes(cc.lower())].add(i)
+            # fields are joined with a NUL so a term can never match across them
+            text = b"\x00".join([
+                force_bytes(x["lc"]),
+                force_bytes(x["ln"].lower()),
+                force_bytes(x["ang"].lower()),
+                force_bytes(x["lr"].lower())
+            ])
+            self.texts.append(text)
+            for gram in self.split_ngrams(text):
+                self.ngrams[gram].add(i)
+
+    @classmethod
+    def split_ngrams(cls, text):
+        n = cls.NGRAM_SIZE
+        return set(text[i:i + n] for i in range(len(text) - n + 1))
+
+    def code_prefix_matches(self, term):
+        matches = []
+        for pos in range(bisect.bisect_left(self.codes, (term,)), len(self.codes)):
+            code, i = self.codes[pos]
+            if not code.startswith(term):
+                break
+            matches.append(i)
+        return sorted(matches)
+
+    def country_matches(self, term):
+        return sorted(self.countries.get(term, []))
+
+    def substring_matches(self, term):
+        postings = [self.ngrams.get(gram, set()) for gram in self.split_ngrams(term)]
+        if not postings:
+            return []
+        postings.sort(key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        return sorted(i for i in candidates if term in self.texts[i])
+
+    def search(self, term):
+        """
+        Return the langnames entries matching `term`, a lowercased, utf-8
+        encoded search string, in the same order the list scans produced:
+        code prefix and country matches for short terms, substring matches
+        for terms of three or more characters.
+        """
+        matches = []
+        if len(term) <= 3:
+            matches.extend(self.code_prefix_matches(term))
+            matches.extend(self.country_matches(term))
+        if len(term) >= 3:
+            matches.extend(self.substring_matches(term))
+        return [self.data[i] for i in matches]
+
+
+_index = None
+
+
+def get_index(loader):
+    """
+    Return this worker's `LanguageNamesIndex`, rebuilding it from `loader()`
+    only when the langnames generation has moved on.
+    """
+    global _index
+    generation = get_generation()
+    if _index is not None and _index.generation == generation:
+        return _index
+    data = loader()
+    index = LanguageNamesIndex(data, generation)
+    if data:
+        # an empty list means the cache is being rebuilt; don't hold on to it
+        _index = index
+    return index
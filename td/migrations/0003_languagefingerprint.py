@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('td', '0002_language_anglicized_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LanguageFingerprint',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('code', models.CharField(unique=True, max_length=100)),
+                ('fingerprint', models.CharField(max_length=40)),
+            ],
+            options={
+                'db_table': 'uw_languagefingerprint',
+            },
+            bases=(models.Model,),
+        ),
+    ]
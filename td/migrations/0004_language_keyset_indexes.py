@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('td', '0003_languagefingerprint'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='language',
+            index_together=set([('code', 'id'), ('iso_639_3', 'id'), ('name', 'id'), ('anglicized_name', 'id'), ('native_speakers', 'id'), ('gateway_flag', 'id')]),
+        ),
+    ]
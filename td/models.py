@@ -7,6 +7,8 @@ from django.utils.encoding import python_2_unicode_compatible
 from jsonfield import JSONField
 from model_utils import FieldTracker
 
+from .utils import chunked_rows, joined_chunks
+
 
 @python_2_unicode_compatible
 class AdditionalLanguage(models.Model):
@@ -92,6 +94,25 @@ class Country(models.Model):
             self._gateway_language = next(iter(Language.objects.filter(code=data.get("gateway_language"))), None)
         return self._gateway_language
 
+    @classmethod
+    def gateway_language_map(cls, queryset=None):
+        """
+        Return the gateway language named in each country's `extra_data`,
+        keyed by country pk, resolving every code in one query
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        extra_data = cls._meta.get_field("extra_data")
+        codes = {}
+        for pk, data in queryset.values_list("pk", "extra_data"):
+            data = extra_data.to_python(data)
+            if isinstance(data, dict) and data.get("gateway_language"):
+                codes[pk] = data["gateway_language"]
+        languages = {}
+        for language in Language.objects.filter(code__in=set(codes.values())):
+            languages[language.code] = language
+        return {pk: languages[code] for pk, code in codes.items() if code in languages}
+
     def gateway_languages(self, with_primary=True):
         gl = self.gateway_language()
         if gl:
@@ -113,26 +134,6 @@ class Country(models.Model):
         qs = qs.order_by("region.name")
         return qs
 
-    @classmethod
-    def gateway_data(cls):
-        with_gateways = cls.objects.filter(language__gateway_language__isnull=False).distinct()
-        without_gateways = cls.objects.exclude(pk__in=with_gateways)
-        data = {
-            x.code: {"obj": x, "gateways": defaultdict(lambda: [])}
-            for x in with_gateways
-        }
-        data.update({
-            x.code: {"obj": x, "gateways": {"n/a": list(x.language_set.all())}}
-            for x in without_gateways
-        })
-        for country in with_gateways:
-            for lang in country.language_set.all():
-                if lang.gateway_language:
-                    data[country.code]["gateways"][lang.gateway_language.code].append(lang)
-                else:
-                    data[country.code]["gateways"]["n/a"].append(lang)
-        return data
-
     def __str__(self):
         return self.name
 
@@ -159,6 +160,11 @@ class Language(models.Model):
 
     class Meta:
         db_table = 'uw_language'
+        # keyset pagination seeks on (sort column, id)
+        index_together = [
+            ("code", "id"), ("iso_639_3", "id"), ("name", "id"), ("anglicized_name", "id"),
+            ("native_speakers", "id"), ("gateway_flag", "id")
+        ]
 
     def __str__(self):
         return self.name
@@ -208,13 +214,63 @@ class Language(models.Model):
         ])
 
     @classmethod
-    def names_data(cls):
+    def codes_text_chunks(cls):
+        rows = chunked_rows(cls.objects.values_list("code"), "code")
+        return joined_chunks((row[0].encode("utf-8") for row in rows), " ")
+
+    @classmethod
+    def names_text_chunks(cls):
+        rows = chunked_rows(cls.objects.values_list("code", "name"), "code")
+        return joined_chunks(("{}\t{}".format(code, name.encode("utf-8")) for code, name in rows), "\n")
+
+    def names_entry(self):
+        return self.names_data(Language.objects.filter(pk=self.pk))[0]
+
+    @classmethod
+    def names_data(cls, queryset=None):
+        """
+        Project languages into langnames entries with a fixed number of
+        queries: one joined `values()` fetch for the languages and their
+        regions, one for the `country_id` attributes and one for country codes.
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        attributes = LanguageEAV.objects.filter(attribute="country_id", entity__in=queryset)
+        country_pks = defaultdict(set)
+        for entity_id, value in attributes.values_list("entity_id", "value"):
+            if value.isdigit():
+                country_pks[entity_id].add(int(value))
+        country_codes = dict(Country.objects.values_list("pk", "code"))
+        directions = dict(cls.DIRECTION_CHOICES)
+        rows = queryset.order_by("code").values(
+            "pk", "code", "name", "anglicized_name", "gateway_flag", "direction", "country__region__name"
+        )
         return [
-            dict(pk=x.pk, lc=x.lc, ln=x.ln, ang=x.ang, cc=x.cc_all, lr=x.lr, gw=x.gateway_flag, ld=x.get_direction_display())
-            for x in cls.objects.all().order_by("code")
+            dict(
+                pk=x["pk"],
+                lc=x["code"],
+                ln=x["name"].encode("utf-8"),
+                ang=x["anglicized_name"],
+                cc=[country_codes[pk].encode("utf-8") for pk in sorted(country_pks[x["pk"]]) if pk in country_codes],
+                lr=(x["country__region__name"] or "").encode("utf-8"),
+                gw=x["gateway_flag"],
+                ld=directions.get(x["direction"], x["direction"])
+            )
+            for x in rows
         ]
 
 
+class LanguageFingerprint(models.Model):
+    """
+    Hash of the merged source rows a language was last integrated from
+    """
+    code = models.CharField(max_length=100, unique=True)
+    fingerprint = models.CharField(max_length=40)
+
+    class Meta:
+        db_table = 'uw_languagefingerprint'
+
+
 class EAVBase(models.Model):
     attribute = models.CharField(max_length=100)
     value = models.CharField(max_length=250)
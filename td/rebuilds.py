@@ -0,0 +1,123 @@
+import threading
+
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.decorators import ContextDecorator
+
+
+REBUILD_WINDOW = 30  # seconds
+
+_state = threading.local()
+
+
+def deferring():
+    return bool(getattr(_state, "stack", None))
+
+
+def run_later(key, func):
+    """
+    Call `func` now, or, inside a `deferred_rebuilds` block, once after the
+    block has committed no matter how often `key` was requested in it.
+    """
+    if deferring():
+        _state.pending.setdefault(key, func)
+    else:
+        func()
+
+
+def commit_hooks(connection):
+    """
+    The callbacks waiting on the current transaction of `connection`, by key,
+    each with the savepoints that were open when it was requested. The first
+    call wraps the connection's commit to run them, its rollback to drop them
+    and its savepoint rollback to drop those requested inside the savepoint.
+    """
+    if not hasattr(connection, "commit_hooks"):
+        connection.commit_hooks = OrderedDict()
+        commit, rollback = connection.commit, connection.rollback
+        savepoint_rollback = connection.savepoint_rollback
+
+        def run_hooks():
+            commit()
+            hooks, connection.commit_hooks = connection.commit_hooks, OrderedDict()
+            for sids, func in hooks.values():
+                func()
+
+        def drop_hooks():
+            connection.commit_hooks.clear()
+            rollback()
+
+        def drop_savepoint_hooks(sid):
+            savepoint_rollback(sid)
+            for key, (sids, func) in list(connection.commit_hooks.items()):
+                if sid in sids:
+                    del connection.commit_hooks[key]
+
+        connection.commit, connection.rollback = run_hooks, drop_hooks
+        connection.savepoint_rollback = drop_savepoint_hooks
+    return connection.commit_hooks
+
+
+def on_commit(key, func):
+    """
+    Call `func` now, or, inside a transaction, once after it has committed
+    no matter how often `key` was requested in it. Requests made inside a
+    savepoint that is rolled back are dropped. Django 1.8 has no
+    `transaction.on_commit`.
+    """
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        commit_hooks(connection).setdefault(key, (set(connection.savepoint_ids), func))
+    else:
+        func()
+
+
+def enqueue(task, window=REBUILD_WINDOW):
+    """
+    Enqueue `task` to run in `window` seconds unless a run is already
+    pending; every request made in the meantime is served by that one run.
+    """
+    if cache.add("rebuild_scheduled:{0}".format(task.name), True, window):
+        task.apply_async(countdown=window)
+        return True
+    return False
+
+
+def schedule(task, window=REBUILD_WINDOW):
+    run_later(task.name, lambda: enqueue(task, window))
+
+
+class deferred_rebuilds(ContextDecorator):
+    """
+    Run a bulk operation in a transaction and hold back the rebuilds it
+    requests until the outermost block has committed, e.g.
+
+        with deferred_rebuilds():
+            for language in languages:
+                language.save()
+
+    or as a decorator on the function doing the bulk work. Rebuilds held
+    back by a block that raises are dropped along with its transaction.
+    """
+
+    def __enter__(self):
+        if not deferring():
+            _state.stack = []
+            _state.pending = OrderedDict()
+        atomic = transaction.atomic()
+        atomic.__enter__()
+        _state.stack.append(atomic)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        atomic = _state.stack.pop()
+        try:
+            atomic.__exit__(exc_type, exc_value, traceback)
+        finally:
+            if not _state.stack:
+                pending, _state.pending = _state.pending, OrderedDict()
+                # a rolled back block changed nothing that needs rebuilding
+                if exc_type is None:
+                    for func in pending.values():
+                        func()
@@ -1,4 +1,3 @@
-from django.core.cache import cache
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.core.exceptions import ObjectDoesNotExist
@@ -9,9 +8,11 @@ from account.signals import user_login_attempt, user_logged_in
 
 from pinax.eventlog.models import log
 
+from . import caching, rebuilds
 from .models import AdditionalLanguage
-from td.models import Country, Language
-from .tasks import reset_langnames_cache
+from td.models import Country, Language, Region
+from td.tracking.models import Charter, Event
+from .tasks import reset_langnames_cache, update_langnames_entry
 from .signals import languages_integrated
 
 
@@ -35,31 +36,82 @@ def handle_additionallanguage_delete(sender, instance, **kwargs):
         pass
 
 
+def handle_language_change(instance):
+    if rebuilds.deferring():
+        rebuilds.schedule(reset_langnames_cache)
+    else:
+        update_langnames_entry.delay(instance.pk)
+    caching.bump(caching.LANGUAGE)
+
+
 @receiver(post_save, sender=Language)
-def handle_language_save(sender, **kwargs):
-    reset_langnames_cache.delay()
-    cache.set("map_gateway_refresh", True)
+def handle_language_save(sender, instance, **kwargs):
+    handle_language_change(instance)
 
 
 @receiver(post_delete, sender=Language)
-def handle_language_delete(sender, **kwargs):
-    reset_langnames_cache.delay()
-    cache.set("map_gateway_refresh", True)
+def handle_language_delete(sender, instance, **kwargs):
+    handle_language_change(instance)
+
+
+def handle_place_change(name):
+    # langnames carries each language's country codes and region name
+    rebuilds.schedule(reset_langnames_cache)
+    caching.bump(name)
 
 
 @receiver(post_save, sender=Country)
 def handle_country_save(sender, **kwargs):
-    cache.set("map_gateway_refresh", True)
+    handle_place_change(caching.COUNTRY)
 
 
 @receiver(post_delete, sender=Country)
 def handle_country_delete(sender, **kwargs):
-    cache.set("map_gateway_refresh", True)
+    handle_place_change(caching.COUNTRY)
+
+
+@receiver(post_save, sender=Region)
+def handle_region_save(sender, **kwargs):
+    handle_place_change(caching.REGION)
+
+
+@receiver(post_delete, sender=Region)
+def handle_region_delete(sender, **kwargs):
+    handle_place_change(caching.REGION)
+
+
+# data source tables edited a row at a time; the imports tables are only
+# written by their bulk loads, which bump their generation themselves
+COUNTED_MODELS = [AdditionalLanguage, Charter, Event]
+
+
+def handle_counted_change(sender, **kwargs):
+    caching.bump(caching.model_generation(sender))
+
+
+for model in COUNTED_MODELS:
+    post_save.connect(handle_counted_change, sender=model)
+    post_delete.connect(handle_counted_change, sender=model)
+
+
+# integrations writing more languages than this rebuild langnames in full
+LANGNAMES_PATCH_LIMIT = 50
+
+
+def patch_langnames_entries(codes):
+    for pk in Language.objects.filter(code__in=codes).values_list("pk", flat=True):
+        update_langnames_entry.delay(pk)
 
 
 @receiver(languages_integrated)
-def handle_languages_integrated(sender, **kwargs):
-    reset_langnames_cache.delay()
+def handle_languages_integrated(sender, codes=None, **kwargs):
+    if codes is not None and len(codes) == 0:
+        return
+    if codes is not None and len(codes) <= LANGNAMES_PATCH_LIMIT:
+        rebuilds.run_later("langnames_entries", lambda: patch_langnames_entries(codes))
+    else:
+        rebuilds.schedule(reset_langnames_cache)
+    caching.bump(caching.LANGUAGE)
 
 
 @receiver(user_logged_in)
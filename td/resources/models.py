@@ -1,57 +1,10 @@
 from django.db import models
-from django.core.urlresolvers import reverse
 from django.utils.encoding import python_2_unicode_compatible
 from jsonfield import JSONField
 
 from td.models import Language
 
 
-def transform_country_data(data):
-    tree = {"name": "World", "parent": None, "children": []}
-    for code in data:
-        datum = {
-            "name": data[code]["obj"].name,
-            "parent": "World",
-            "children": [],
-            "hasGatewayLanguages": len(data[code]["gateways"]) > 1,
-            "detailUrl": reverse("country_detail", args=[data[code]["obj"].pk])
-        }
-        for gateway in data[code]["gateways"]:
-            if gateway == "n/a":
-                name = "No Gateway"
-            else:
-                name = data[code]["gateways"][gateway][0].gateway_language.name
-            gdatum = {
-                "name": name,
-                "parent": data[code]["obj"].name,
-                "children": [
-                    {
-                        "name": l.name,
-                        "detailUrl": reverse("language_detail", args=[l.pk]),
-                        "parent": name,
-                        "children": []
-                    }
-                    for l in data[code]["gateways"][gateway]
-                ],
-                "notGatewayLanguage": gateway == "n/a"
-            }
-            datum["children"].append(gdatum)
-        tree["children"].append(datum)
-    return tree
-
-"""
-tree = {
-    "name": "Root",
-    "parent": None,
-    "children": [
-        {"name": "", "parent": "Root", "children": []},
-        {"name": "", "parent": "Root", "children": []},
-        {"name": "", "parent": "Root", "children": []},
-    ]
-}
-"""
-
-
 @python_2_unicode_compatible
 class Media(models.Model):
     name = models.CharField(max_length=100)
@@ -1,94 +1,254 @@
+import json
+
+from collections import OrderedDict, defaultdict
+
 from django.conf import settings
-from django.core.cache import cache
-from django.core.urlresolvers import reverse
 from celery import task
 import requests
 from pinax.eventlog.models import log
-from .models import Title, Media
+from .models import Resource, Title, Media
+from td.imports.fetch import Fetcher
+from td import caching
 from td.models import Country, Language
-
-
-def _get_obs_api_data():
-    r = requests.get(settings.UWADMIN_OBS_API_URL)
-    return r
-
-
-def _clean_json_data(response):
-    try:
-        return response.json()
-    except ValueError:
-        return None
-
-
-def _process_obs_response(response):
-    if response.status_code != 200 or _clean_json_data(response) is None:
-        log(
-            user=None,
-            action="GET_OBS_CATALOG_FAILED",
-            extra={"status_code": response.status_code, "text": response.content}
+from td.utils import bulk_update, url_template
+
+
+class OBSCatalogFetcher(Fetcher):
+
+    url = settings.UWADMIN_OBS_API_URL
+    error_action_label = "GET_OBS_CATALOG_FAILED"
+
+
+def sync_obs_catalog(rows):
+    """
+    Bring the Open Bible Stories resources in line with the catalog `rows`,
+    writing only the resources whose status changed and the media links
+    that are missing. Returns the processed, created, updated and unchanged
+    counts.
+    """
+    title, _ = Title.objects.get_or_create(slug="open-bible-stories", defaults={"name": "Open Bible Stories"})
+    medias = [
+        Media.objects.get_or_create(slug="print", defaults={"name": "Print"})[0],
+        Media.objects.get_or_create(slug="mobile", defaults={"name": "Mobile"})[0]
+    ]
+    languages = dict(Language.objects.filter(code__in=set(row["language"] for row in rows)).values_list("code", "pk"))
+    # a language listed twice takes its last status
+    statuses = dict((languages[row["language"]], row["status"]) for row in rows if row["language"] in languages)
+    extra_data = Resource._meta.get_field("extra_data")
+    existing = {
+        language_id: (pk, extra_data.to_python(data))
+        for pk, language_id, data in title.versions.filter(language_id__in=statuses).values_list(
+            "pk", "language_id", "extra_data"
         )
-    else:
-        title, _ = Title.objects.get_or_create(slug="open-bible-stories", defaults={"name": "Open Bible Stories"})
-        medias = (Media.objects.get_or_create(slug="print", defaults={"name": "Print"}),
-                  Media.objects.get_or_create(slug="mobile", defaults={"name": "Mobile"}))
-        record_count = resources_created = resources_updated = 0
-        for row in response.json():
-            lang = next(iter(Language.objects.filter(code=row["language"])), None)
-            if lang:
-                resource, created = lang.resources.get_or_create(title=title)
-                resource.extra_data = row["status"]
-                resource.save()
-                for media, _ in medias:
-                    resource.medias.add(media)
-                if created:
-                    resources_created += 1
-                else:
-                    resources_updated += 1
-            record_count += 1
-        log(
-            user=None,
-            action="GET_OBS_CATALOG_SUCCEEDED",
-            extra={"records_processed": record_count, "resources_created": resources_created, "resources_updated": resources_updated}
+    }
+    created = [
+        Resource(title=title, language_id=language_id, extra_data=status)
+        for language_id, status in statuses.items()
+        if language_id not in existing
+    ]
+    updated = [
+        {"pk": existing[language_id][0], "extra_data": status}
+        for language_id, status in statuses.items()
+        if language_id in existing and existing[language_id][1] != status
+    ]
+    Resource.objects.bulk_create(created, batch_size=500)
+    bulk_update(Resource, updated, ["extra_data"])
+    if created:
+        existing.update(
+            (language_id, (pk, None))
+            for pk, language_id in title.versions.filter(language_id__in=statuses).values_list("pk", "language_id")
         )
-    return response.json()
+    through = Resource.medias.through
+    resource_ids = [existing[language_id][0] for language_id in statuses]
+    linked = set(through.objects.filter(resource_id__in=resource_ids).values_list("resource_id", "media_id"))
+    through.objects.bulk_create([
+        through(resource_id=resource_id, media_id=media.pk)
+        for resource_id in resource_ids
+        for media in medias
+        if (resource_id, media.pk) not in linked
+    ], batch_size=500)
+    return {
+        "records_processed": len(rows),
+        "resources_created": len(created),
+        "resources_updated": len(updated),
+        "resources_unchanged": len(statuses) - len(created) - len(updated)
+    }
 
 
 def update_obs_resources():
-    _process_obs_response(_get_obs_api_data())
+    """
+    Sync the OBS resources with the catalog, unless the catalog API reports
+    or hashes it as unchanged since the last sync
+    """
+    fetcher = OBSCatalogFetcher(requests.Session())
+    content = fetcher.fetch()
+    if not content:
+        return
+    try:
+        data = json.loads(content)
+    except ValueError:
+        log(user=None, action="GET_OBS_CATALOG_FAILED", extra={"status_code": 200, "text": content})
+        return
+    log(user=None, action="GET_OBS_CATALOG_SUCCEEDED", extra=sync_obs_catalog(data))
+    fetcher.loaded()
 
 
 def seed_languages_gateway_language():
-    for lang in Language.objects.filter(gateway_language=None, gateway_flag=False):
-        if lang.country and lang.country.gateway_language():
-            lang.gateway_language = lang.country.gateway_language()
-            lang.save()
+    """
+    Give languages without a gateway the gateway language of their country,
+    with one UPDATE per gateway. Returns the number of languages assigned to
+    each gateway, by code.
+    """
+    countries = defaultdict(list)
+    for country_id, gateway in Country.gateway_language_map().items():
+        countries[gateway].append(country_id)
+    counts = {}
+    for gateway, country_ids in countries.items():
+        updated = Language.objects.filter(
+            gateway_language=None,
+            gateway_flag=False,
+            country_id__in=country_ids
+        ).update(gateway_language=gateway)
+        if updated:
+            counts[gateway.code] = updated
+    if counts:
+        caching.bump(caching.LANGUAGE)
+    return counts
+
+
+MAP_GATEWAYS_DEPENDS = [caching.LANGUAGE, caching.COUNTRY]
+COUNTRY_TREE_DEPENDS = [caching.LANGUAGE, caching.COUNTRY]
+
+
+def country_gateway_languages(gateway, languages):
+    """
+    Return the gateway languages of a country as `Country.gateway_languages`
+    does, from its primary gateway and its languages' rows
+    """
+    ogls = [gateway] if gateway else []
+    pks = set(x["pk"] for x in ogls)
+    for lang in languages:
+        if lang["gateway_flag"] and lang["pk"] not in pks:
+            ogls.append(lang)
+            pks.add(lang["pk"])
+        elif lang["gateway_language_id"] and lang["gateway_language_id"] not in pks:
+            ogls.append({
+                "pk": lang["gateway_language_id"],
+                "code": lang["gateway_language__code"],
+                "name": lang["gateway_language__name"]
+            })
+            pks.add(lang["gateway_language_id"])
+    return ogls
+
+
+def build_map_gateways():
+    """
+    Return the `map_gateways` data for every country in a fixed number of
+    queries: the countries, their extra_data gateways and their languages
+    with their gateway's code and name
+    """
+    gateways = {
+        pk: {"pk": x.pk, "code": x.code, "name": x.name}
+        for pk, x in Country.gateway_language_map().items()
+    }
+    languages = defaultdict(list)
+    for lang in Language.objects.filter(country__isnull=False).order_by("pk").values(
+        "pk", "code", "name", "gateway_flag", "country_id",
+        "gateway_language_id", "gateway_language__code", "gateway_language__name"
+    ):
+        languages[lang["country_id"]].append(lang)
+    url = url_template("country_detail")
+    country_gateways = {}
+    for pk, code, alpha_3_code in Country.objects.order_by("pk").values_list("pk", "code", "alpha_3_code"):
+        gateway = gateways.get(pk)
+        country_gateways[alpha_3_code] = {
+            "fillKey": gateway["code"] if gateway else "defaultFill",
+            "url": url.format(pk),
+            "country_code": code,
+            "gateway_language": gateway["name"] if gateway else "",
+            "gateway_languages": [
+                u"({0}) {1}".format(x["code"], x["name"])
+                for x in country_gateway_languages(gateway, languages[pk])
+            ]
+        }
+    return country_gateways
 
 
 def update_map_gateways():
-    country_gateways = {
-        country.alpha_3_code: {
-            "fillKey": country.gateway_language().code if country.gateway_language() else "defaultFill",
-            "url": reverse("country_detail", args=[country.pk]),
-            "country_code": country.code,
-            "gateway_language": country.gateway_language().name if country.gateway_language() else "",
-            "gateway_languages": [unicode("({0}) {1}").format(ogl.code, ogl.name) for ogl in country.gateway_languages()]
-        }
-        for country in Country.objects.all()
-    }
-    cache.set("map_gateways", country_gateways)
+    data = build_map_gateways()
     log(user=None, action="UPDATE_MAP_GATEWAYS")
+    return data
 
 
 def get_map_gateways():
-    mg = cache.get("map_gateways", None)
-    if not mg:
-        update_map_gateways()
-        mg = cache.get("map_gateways", {})
-    return mg
+    return caching.get_derived("map_gateways", MAP_GATEWAYS_DEPENDS, update_map_gateways)
 
 
 @task()
 def check_map_gateways():
-    if cache.get("map_gateways_refresh", True):
-        cache.set("map_gateways_refresh", False)
-        update_map_gateways()
+    """
+    Build the map gateways for the current data ahead of the first request
+    """
+    get_map_gateways()
+
+
+def country_tree_gateways(languages):
+    """
+    Group a country's languages by the code of their gateway language, with
+    languages that have none under "n/a"
+    """
+    gateways = OrderedDict()
+    for lang in languages:
+        key = lang["gateway_language__code"] if lang["gateway_language_id"] else "n/a"
+        if key not in gateways:
+            gateways[key] = {"name": lang["gateway_language__name"] if key != "n/a" else "No Gateway", "languages": []}
+        gateways[key]["languages"].append(lang)
+    if not gateways:
+        gateways["n/a"] = {"name": "No Gateway", "languages": []}
+    return gateways
+
+
+def build_country_tree():
+    """
+    Return the World > country > gateway > language tree behind
+    country_gateways.json from two queries: the countries and their
+    languages with their gateway's code and name
+    """
+    languages = defaultdict(list)
+    for lang in Language.objects.filter(country__isnull=False).order_by("pk").values(
+        "pk", "name", "country_id", "gateway_language_id", "gateway_language__code", "gateway_language__name"
+    ):
+        languages[lang["country_id"]].append(lang)
+    country_url = url_template("country_detail")
+    language_url = url_template("language_detail")
+    tree = {"name": "World", "parent": None, "children": []}
+    for pk, name in Country.objects.order_by("code").values_list("pk", "name"):
+        gateways = country_tree_gateways(languages[pk])
+        tree["children"].append({
+            "name": name,
+            "parent": "World",
+            "children": [
+                {
+                    "name": gateway["name"],
+                    "parent": name,
+                    "children": [
+                        {
+                            "name": lang["name"],
+                            "detailUrl": language_url.format(lang["pk"]),
+                            "parent": gateway["name"],
+                            "children": []
+                        }
+                        for lang in gateway["languages"]
+                    ],
+                    "notGatewayLanguage": code == "n/a"
+                }
+                for code, gateway in gateways.items()
+            ],
+            "hasGatewayLanguages": len(gateways) > 1,
+            "detailUrl": country_url.format(pk)
+        })
+    return tree
+
+
+def get_country_tree():
+    return caching.get_derived("country_tree", COUNTRY_TREE_DEPENDS, build_country_tree)
@@ -0,0 +1,76 @@
+from collections import defaultdict
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from td import caching
+from td.models import Country, Language
+from td.tests.utils import committed
+from ..tasks import build_country_tree, get_country_tree
+
+
+def per_country_tree():
+    # the per-country computation the builder replaces
+    tree = {"name": "World", "parent": None, "children": []}
+    for country in Country.objects.all():
+        gateways = defaultdict(list)
+        for lang in country.language_set.all():
+            gateways[lang.gateway_language.code if lang.gateway_language else "n/a"].append(lang)
+        if not gateways:
+            gateways["n/a"] = []
+        datum = {
+            "name": country.name,
+            "parent": "World",
+            "children": [],
+            "hasGatewayLanguages": len(gateways) > 1,
+            "detailUrl": reverse("country_detail", args=[country.pk])
+        }
+        for gateway, languages in gateways.items():
+            name = "No Gateway" if gateway == "n/a" else languages[0].gateway_language.name
+            datum["children"].append({
+                "name": name,
+                "parent": country.name,
+                "children": [
+                    {"name": l.name, "detailUrl": reverse("language_detail", args=[l.pk]), "parent": name, "children": []}
+                    for l in languages
+                ],
+                "notGatewayLanguage": gateway == "n/a"
+            })
+        tree["children"].append(datum)
+    return tree
+
+
+def ordered(node):
+    return dict(node, children=sorted((ordered(x) for x in node["children"]), key=lambda x: x["name"]))
+
+
+class CountryTreeTestCase(TestCase):
+
+    def setUp(self):
+        c1 = Country.objects.create(code="c1", name="Country 1")
+        c2 = Country.objects.create(code="c2", name="Country 2")
+        Country.objects.create(code="c3", name="Country 3")
+        tg1 = Language.objects.create(code="tg1", name="Gateway 1", gateway_flag=True, country=c1)
+        Language.objects.create(code="tl1", name="Lang 1", country=c1, gateway_language=tg1)
+        Language.objects.create(code="tl2", name="Lang 2", country=c2, gateway_language=tg1)
+        Language.objects.create(code="tl3", name="Lang 3", country=c2)
+
+    def test_matches_per_country_computation(self):
+        self.assertEquals(ordered(build_country_tree()), ordered(per_country_tree()))
+
+    def test_query_count(self):
+        with self.assertNumQueries(2):
+            tree = build_country_tree()
+        self.assertEquals([x["name"] for x in tree["children"]], ["Country 1", "Country 2", "Country 3"])
+        self.assertEquals([x["hasGatewayLanguages"] for x in tree["children"]], [True, True, False])
+        self.assertEquals(tree["children"][1]["children"][0]["children"][0]["detailUrl"],
+                          reverse("language_detail", args=[Language.objects.get(code="tl2").pk]))
+
+    def test_cached_until_languages_change(self):
+        caching.bump_now(caching.LANGUAGE)
+        get_country_tree()
+        with self.assertNumQueries(0):
+            get_country_tree()
+        with committed():
+            Language.objects.create(code="tl4", name="Lang 4", country=Country.objects.get(code="c3"))
+        tree = get_country_tree()
+        self.assertEquals(tree["children"][2]["children"][0]["children"][0]["name"], "Lang 4")
@@ -0,0 +1,47 @@
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from td.models import Country, Language
+from ..tasks import build_map_gateways
+
+
+def per_country_map_gateways():
+    # the per-country computation the builder replaces
+    return {
+        country.alpha_3_code: {
+            "fillKey": country.gateway_language().code if country.gateway_language() else "defaultFill",
+            "url": reverse("country_detail", args=[country.pk]),
+            "country_code": country.code,
+            "gateway_language": country.gateway_language().name if country.gateway_language() else "",
+            "gateway_languages": [u"({0}) {1}".format(ogl.code, ogl.name) for ogl in country.gateway_languages()]
+        }
+        for country in Country.objects.order_by("pk")
+    }
+
+
+class MapGatewaysTestCase(TestCase):
+
+    def setUp(self):
+        c1 = Country.objects.create(code="c1", alpha_3_code="cc1", name="Country 1", extra_data={"gateway_language": "mg1"})
+        c2 = Country.objects.create(code="c2", alpha_3_code="cc2", name="Country 2")
+        c3 = Country.objects.create(code="c3", alpha_3_code="cc3", name="Country 3", extra_data={"gateway_language": "nope"})
+        Country.objects.create(code="c4", alpha_3_code="cc4", name="Country 4", extra_data="")
+        mg1 = Language.objects.create(code="mg1", name="Gateway 1", gateway_flag=True, country=c1)
+        mg2 = Language.objects.create(code="mg2", name="Gateway 2", gateway_flag=True, country=c2)
+        Language.objects.create(code="ml1", name="Lang 1", country=c1, gateway_language=mg2)
+        Language.objects.create(code="ml2", name="Lang 2", country=c2, gateway_language=mg1)
+        Language.objects.create(code="ml3", name="Lang 3", country=c2, gateway_language=mg1)
+        Language.objects.create(code="ml4", name="Lang 4", country=c3)
+
+    def test_matches_per_country_computation(self):
+        self.assertEquals(build_map_gateways(), per_country_map_gateways())
+
+    def test_query_count(self):
+        with self.assertNumQueries(4):
+            data = build_map_gateways()
+        self.assertEquals(data["cc1"]["gateway_languages"], [u"(mg1) Gateway 1", u"(mg2) Gateway 2"])
+        self.assertEquals(data["cc2"]["fillKey"], "defaultFill")
+        for code in ["c5", "c6", "c7"]:
+            country = Country.objects.create(code=code, alpha_3_code="c" + code, name=code)
+            Language.objects.create(code="m" + code, name=code, country=country)
+        with self.assertNumQueries(4):
+            build_map_gateways()
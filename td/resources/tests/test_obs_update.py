@@ -1,8 +1,14 @@
+import copy
+import json
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from mock import patch
 from ..models import Resource
+from td.imports.tests.test_reloads import TemporarySnapshotsMixin
 from td.models import Language
-from ..tasks import _process_obs_response
+from ..tasks import sync_obs_catalog, update_obs_resources
 from pinax.eventlog.models import Log
 
 
@@ -35,7 +41,7 @@ GOOD_JSON_DATA = [{"date_modified": "20141208",
                    "string": "Fran\u00e7ais"}]
 
 
-class OBSTestCase(TestCase):
+class OBSTestCase(TemporarySnapshotsMixin, TestCase):
     @classmethod
     def setUpClass(cls):
         super(OBSTestCase, cls).setUpClass()
@@ -44,21 +50,58 @@ class OBSTestCase(TestCase):
         lang2 = Language(code="z2", name="Z Test 2")
         lang2.save()
 
+    def fetch(self, status_code, content):
+        with patch("td.resources.tasks.requests.Session") as Session:
+            Session().get().status_code = status_code
+            Session().get().headers = {}
+            Session().get().content = content
+            update_obs_resources()
+
     def test_good_obs_fetch(self):
         Resource.objects.all().delete()
         self.assertEquals(Resource.objects.all().count(), 0)
-        with patch("requests.Response") as mock_response:
-            mock_response.status_code = 200
-            mock_response.json.return_value = GOOD_JSON_DATA
-            _process_obs_response(mock_response)
-            self.assertEquals(Resource.objects.count(), len(GOOD_JSON_DATA))
+        self.fetch(200, json.dumps(GOOD_JSON_DATA))
+        self.assertEquals(Resource.objects.count(), len(GOOD_JSON_DATA))
+        self.assertTrue(Log.objects.filter(action="GET_OBS_CATALOG_SUCCEEDED").exists())
 
     def test_bad_obs_fetch(self):
         Resource.objects.all().delete()
         self.assertEquals(Resource.objects.all().count(), 0)
-        with patch("requests.Response") as mock_response:
-            mock_response.status_code = 404
-            mock_response.content = ""
-            _process_obs_response(mock_response)
-            self.assertEquals(Resource.objects.all().count(), 0)
-            self.assertTrue(Log.objects.filter(action="GET_OBS_CATALOG_FAILED").exists())
+        self.fetch(404, "")
+        self.assertEquals(Resource.objects.all().count(), 0)
+        self.assertTrue(Log.objects.filter(action="GET_OBS_CATALOG_FAILED").exists())
+
+    def test_invalid_obs_json(self):
+        self.fetch(200, "not json")
+        self.assertEquals(Log.objects.filter(action="GET_OBS_CATALOG_FAILED").latest("pk").extra["text"], "not json")
+
+    def test_sync_writes_only_changes(self):
+        sync_obs_catalog(GOOD_JSON_DATA)
+        resource = Resource.objects.get(language__code="z1")
+        self.assertEquals(resource.extra_data["version"], "3.2.1")
+        self.assertEquals(sorted(resource.medias.values_list("slug", flat=True)), ["mobile", "print"])
+        rows = copy.deepcopy(GOOD_JSON_DATA) + [{"language": "zz-unknown", "status": {}}]
+        rows[0]["status"]["version"] = "3.3"
+        with CaptureQueriesContext(connection) as queries:
+            counts = sync_obs_catalog(rows)
+        self.assertEquals(counts, {
+            "records_processed": 3,
+            "resources_created": 0,
+            "resources_updated": 1,
+            "resources_unchanged": 1
+        })
+        self.assertEquals(Resource.objects.get(language__code="z1").extra_data["version"], "3.3")
+        self.assertTrue(len(queries) < 10)
+
+    def test_unchanged_catalog_skipped(self):
+        with patch("td.resources.tasks.requests.Session") as Session:
+            Session().get().status_code = 200
+            Session().get().headers = {"ETag": '"v1"'}
+            Session().get().content = json.dumps(GOOD_JSON_DATA)
+            update_obs_resources()
+            self.assertEquals(Resource.objects.count(), 2)
+            Session().get().status_code = 304
+            with patch("td.resources.tasks.sync_obs_catalog") as sync:
+                update_obs_resources()
+            self.assertFalse(sync.called)
+            self.assertEquals(Session().get.call_args[1]["headers"], {"If-None-Match": '"v1"'})
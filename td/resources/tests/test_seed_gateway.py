@@ -1,5 +1,7 @@
 from django.test import TestCase
+from td import caching
 from td.models import Country, Language
+from td.tests.utils import committed
 from ..tasks import seed_languages_gateway_language
 
 
@@ -24,7 +26,11 @@ class SeedGatewayTestCase(TestCase):
         lang5.save()
 
     def test_seed(self):
-        seed_languages_gateway_language()
+        generation = caching.get_generation(caching.LANGUAGE)
+        with committed(), self.assertNumQueries(3):
+            counts = seed_languages_gateway_language()
+        self.assertEquals(counts, {"gz1": 1})
+        self.assertNotEqual(caching.get_generation(caching.LANGUAGE), generation)
         z1 = Language.objects.get(code="gz1")
         self.assertIsNone(z1.gateway_language)
         self.assertEquals(Language.objects.get(code="gz2").gateway_language, z1)
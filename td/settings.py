@@ -243,6 +243,9 @@ AUTHENTICATION_BACKENDS = [
 
 UWADMIN_OBS_API_URL = "https://api.unfoldingword.org/obs/txt/1/obs-catalog.json"
 
+# every downloaded import source is kept here, keyed by its SHA-1
+IMPORTS_SNAPSHOT_ROOT = os.environ.get("IMPORTS_SNAPSHOT_ROOT", os.path.join(PROJECT_ROOT, "import_snapshots"))
+
 # Celery / Redis Backend configuration
 BROKER_URL = "redis://localhost:6379/0"
 CELERY_IGNORE_RESULT = True   # for now, we don't have any tasks that require looking at the result
@@ -0,0 +1,130 @@
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.db.models.deletion import Collector
+from django.test import TestCase
+
+from mock import Mock, patch
+
+from td.imports.models import SourceReload
+from td.models import Country, Language, Region
+from td.tracking import views as tracking_views  # noqa, registers its data source views
+from .. import caching, rebuilds, receivers
+from ..utils import DataTableSourceView
+from .utils import committed
+
+
+class GenerationTestCase(TestCase):
+
+    def setUp(self):
+        for name in [caching.LANGUAGE, caching.COUNTRY, caching.REGION]:
+            cache.delete(caching.generation_key(name))
+
+    def test_missing_generation_is_seeded(self):
+        generation = caching.get_generation(caching.LANGUAGE)
+        self.assertIsNotNone(generation)
+        self.assertEquals(caching.get_generation(caching.LANGUAGE), generation)
+
+    def test_bump_moves_derived_key(self):
+        key = caching.derived_key("test", [caching.LANGUAGE, caching.COUNTRY])
+        with committed():
+            caching.bump(caching.COUNTRY)
+        self.assertNotEqual(caching.derived_key("test", [caching.LANGUAGE, caching.COUNTRY]), key)
+
+    def test_unrelated_bump_keeps_derived_key(self):
+        key = caching.derived_key("test", [caching.LANGUAGE])
+        with committed():
+            caching.bump(caching.REGION)
+        self.assertEquals(caching.derived_key("test", [caching.LANGUAGE]), key)
+
+    def test_get_derived_rebuilds_only_after_bump(self):
+        build = Mock(side_effect=[1, 2])
+        self.assertEquals(caching.get_derived("test", [caching.LANGUAGE], build), 1)
+        self.assertEquals(caching.get_derived("test", [caching.LANGUAGE], build), 1)
+        with committed():
+            caching.bump(caching.LANGUAGE)
+        self.assertEquals(caching.get_derived("test", [caching.LANGUAGE], build), 2)
+        self.assertEquals(build.call_count, 2)
+
+    def test_bump_deferred_until_block_exits(self):
+        generation = caching.get_generation(caching.LANGUAGE)
+        with committed():
+            with rebuilds.deferred_rebuilds():
+                caching.bump(caching.LANGUAGE)
+                caching.bump(caching.LANGUAGE)
+            self.assertEquals(caching.get_generation(caching.LANGUAGE), generation)
+        self.assertEquals(caching.get_generation(caching.LANGUAGE), generation + 1)
+
+    def test_bump_deferred_until_commit(self):
+        generation = caching.get_generation(caching.LANGUAGE)
+        with committed():
+            with transaction.atomic():
+                Language.objects.create(code="zg2", name="Zlang")
+            self.assertEquals(caching.get_generation(caching.LANGUAGE), generation)
+        self.assertNotEqual(caching.get_generation(caching.LANGUAGE), generation)
+
+    def test_rollback_drops_commit_hooks(self):
+        connection, func = Mock(spec=["commit", "rollback", "savepoint_rollback"]), Mock()
+        rebuilds.commit_hooks(connection)["test"] = (set(), func)
+        connection.rollback()
+        connection.commit()
+        self.assertFalse(func.called)
+        rebuilds.commit_hooks(connection)["test"] = (set(), func)
+        connection.commit()
+        self.assertEquals(func.call_count, 1)
+
+    def test_savepoint_rollback_drops_its_bumps(self):
+        generation = caching.get_generation(caching.COUNTRY)
+        with committed():
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    caching.bump(caching.COUNTRY)
+                    raise ValueError()
+            self.assertEquals(len(rebuilds.commit_hooks(connection)), 0)
+        self.assertEquals(caching.get_generation(caching.COUNTRY), generation)
+
+    def test_writes_bump_generations(self):
+        with patch("td.receivers.reset_langnames_cache"), patch("td.receivers.update_langnames_entry"):
+            for name, create in [
+                (caching.REGION, lambda: Region.objects.create(name="Zregion", slug="zregion")),
+                (caching.COUNTRY, lambda: Country.objects.create(code="zc", name="Zcountry")),
+                (caching.LANGUAGE, lambda: Language.objects.create(code="zg1", name="Zlang"))
+            ]:
+                generation = caching.get_generation(name)
+                with committed():
+                    create()
+                self.assertNotEqual(caching.get_generation(name), generation)
+
+    def test_gateway_upload_bumps_language(self):
+        Language.objects.create(code="zg3", name="Zlang")
+        User.objects.create_user("zuser", password="zpass")
+        self.client.login(username="zuser", password="zpass")
+        generation = caching.get_generation(caching.LANGUAGE)
+        with committed():
+            self.client.post(reverse("gateway_flag_update"), {"languages": "zg3"})
+        self.assertNotEqual(caching.get_generation(caching.LANGUAGE), generation)
+
+
+def data_source_models(view=DataTableSourceView):
+    models = set()
+    for subclass in view.__subclasses__():
+        if getattr(subclass, "model", None) is not None:
+            models.add(subclass.model)
+        models |= data_source_models(subclass)
+    return models
+
+
+class CountedModelsTestCase(TestCase):
+
+    def test_every_data_source_bumps_its_generation(self):
+        per_row = set(receivers.COUNTED_MODELS) | set(
+            apps.get_model(label) for label in caching.MODEL_GENERATIONS
+        )
+        for model in data_source_models():
+            self.assertTrue(model in per_row or issubclass(model, SourceReload), model)
+
+    def test_imports_tables_delete_in_bulk(self):
+        for model in SourceReload.__subclasses__():
+            self.assertTrue(Collector(using="default").can_fast_delete(model.objects.all()), model)
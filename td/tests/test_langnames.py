@@ -0,0 +1,166 @@
+# coding: utf-8
+import gzip
+import json
+
+from io import BytesIO
+
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+
+from mock import call, patch
+
+from .. import langnames
+from ..langnames import LanguageNamesIndex
+from ..tasks import reset_langnames_cache, update_langnames_entry
+from ..views import codes_text_export, names_json_export, names_text_export
+
+
+DATA = [
+    dict(pk=1, lc=u"aa", ln=u"Afaraf".encode("utf-8"), ang=u"Afar", cc=["ET", "DJ"], lr="Africa", gw=False, ld="ltr"),
+    dict(pk=2, lc=u"aaa", ln=u"Ghotuo".encode("utf-8"), ang=u"", cc=["NG"], lr="Africa", gw=False, ld="ltr"),
+    dict(pk=3, lc=u"es-419", ln=u"Español Latin America".encode("utf-8"), ang=u"Spanish", cc=[], lr="", gw=True, ld="ltr"),
+    dict(pk=4, lc=u"et", ln=u"eesti".encode("utf-8"), ang=u"Estonian", cc=["EE"], lr="Europe", gw=False, ld="ltr"),
+    dict(pk=5, lc=u"kmg", ln=u"Kâte".encode("utf-8"), ang=u"Kâte", cc=["PG"], lr="Pacific", gw=False, ld="ltr"),
+]
+
+
+def scan(data, term):
+    # the list scans the index replaces
+    d = []
+    if len(term) <= 3:
+        d.extend([x for x in data if term == x["lc"].lower()[:len(term)]])
+        d.extend([x for x in data if term in [y.lower() for y in x["cc"]]])
+    if len(term) >= 3:
+        d.extend([
+            x
+            for x in data
+            if (
+                term in x["lc"] or term in x["ln"].lower()
+                or term in x["ang"].lower() or term in x["lr"].lower()
+            )
+        ])
+    return d
+
+
+class LanguageNamesIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.index = LanguageNamesIndex(DATA, generation=1)
+
+    def test_matches_list_scan(self):
+        for term in ["", "a", "aa", "aaa", "et", "pg", "afr", "ope", "spanish", "419", "zzz", "ghotuo"]:
+            self.assertEquals(self.index.search(term), scan(DATA, term), term)
+
+    def test_code_prefix(self):
+        self.assertEquals([x["lc"] for x in self.index.search("aa")], [u"aa", u"aaa"])
+
+    def test_country_code(self):
+        self.assertEquals([x["lc"] for x in self.index.search("dj")], [u"aa"])
+
+    def test_non_ascii_term(self):
+        term = u"kâte".encode("utf-8")
+        self.assertEquals([x["lc"] for x in self.index.search(term)], [u"kmg"])
+
+
+class LanguageNamesStoreTestCase(TestCase):
+
+    def setUp(self):
+        cache.delete(langnames.STORE_KEY)
+        cache.delete(langnames.PATCH_LOCK_KEY)
+        langnames.rebuild(DATA)
+
+    def test_rebuild_publishes_flat_list(self):
+        self.assertEquals([x["lc"] for x in cache.get("langnames")], [x["lc"] for x in DATA])
+
+    def test_patch_replaces_entry(self):
+        generation = langnames.get_generation()
+        entry = dict(DATA[3], ln="Eesti keel")
+        self.assertTrue(langnames.patch(4, entry))
+        self.assertEquals(cache.get("langnames")[3]["ln"], "Eesti keel")
+        self.assertNotEquals(langnames.get_generation(), generation)
+
+    def test_patch_inserts_in_code_order(self):
+        entry = dict(DATA[0], pk=6, lc=u"ab", ln="Abkhaz")
+        langnames.patch(6, entry)
+        self.assertEquals([x["lc"] for x in cache.get("langnames")][:3], [u"aa", u"aaa", u"ab"])
+
+    def test_patch_removes_entry(self):
+        langnames.patch(2)
+        self.assertFalse(u"aaa" in [x["lc"] for x in cache.get("langnames")])
+
+    def test_patch_without_store(self):
+        cache.delete(langnames.STORE_KEY)
+        self.assertFalse(langnames.patch(1, DATA[0]))
+
+    def test_patch_waits_for_lock(self):
+        cache.set(langnames.PATCH_LOCK_KEY, True)
+        with patch("td.langnames.time.sleep") as sleep:
+            self.assertFalse(langnames.patch(2))
+        self.assertEquals(sleep.call_count, langnames.PATCH_LOCK_ATTEMPTS)
+        self.assertTrue(u"aaa" in [x["lc"] for x in cache.get("langnames")])
+        cache.delete(langnames.PATCH_LOCK_KEY)
+        self.assertTrue(langnames.patch(2))
+        self.assertIsNone(cache.get(langnames.PATCH_LOCK_KEY))
+
+    def test_patch_after_rebuild_fails(self):
+        with patch("td.langnames.get_generation", side_effect=[1, 2]):
+            self.assertFalse(langnames.patch(2))
+        self.assertTrue(u"aaa" in [x["lc"] for x in cache.get("langnames")])
+
+    def test_rebuild_waits_for_lock(self):
+        cache.set(langnames.PATCH_LOCK_KEY, True)
+        with patch("td.langnames.time.sleep") as sleep:
+            self.assertFalse(langnames.rebuild(DATA[:1]))
+        self.assertEquals(sleep.call_count, langnames.REBUILD_LOCK_ATTEMPTS)
+        self.assertEquals(len(cache.get("langnames")), len(DATA))
+        self.assertTrue(cache.get(langnames.PATCH_LOCK_KEY))
+        cache.delete(langnames.PATCH_LOCK_KEY)
+
+    def test_failed_patches_share_one_rebuild(self):
+        with patch("td.tasks.langnames.patch", return_value=False), patch("td.tasks.rebuilds.enqueue") as enqueue:
+            update_langnames_entry(2)
+            update_langnames_entry(2)
+        self.assertEquals(enqueue.call_args_list, [call(reset_langnames_cache)] * 2)
+
+
+class LanguageNamesExportTestCase(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        for name in langnames.EXPORTS:
+            cache.delete(langnames.export_meta_key(name))
+        langnames.rebuild(DATA)
+
+    def test_rendered_exports(self):
+        self.assertEquals(codes_text_export(self.factory.get("/")).content, "aa aaa es-419 et kmg")
+        names = names_text_export(self.factory.get("/")).content.split("\n")
+        self.assertEquals(names[0], "aa\tAfaraf")
+        data = json.loads(names_json_export(self.factory.get("/")).content)
+        self.assertEquals([x["lc"] for x in data], [x["lc"] for x in DATA])
+
+    def test_gzip_variant(self):
+        response = codes_text_export(self.factory.get("/", HTTP_ACCEPT_ENCODING="gzip, deflate"))
+        self.assertEquals(response["Content-Encoding"], "gzip")
+        self.assertTrue(response["ETag"].endswith('-gzip"'))
+        content = gzip.GzipFile(fileobj=BytesIO(response.content)).read()
+        self.assertEquals(content, "aa aaa es-419 et kmg")
+
+    def test_conditional_request(self):
+        response = names_text_export(self.factory.get("/"))
+        self.assertTrue(response.has_header("Last-Modified"))
+        with self.assertNumQueries(0):
+            response = names_text_export(self.factory.get("/", HTTP_IF_NONE_MATCH=response["ETag"]))
+        self.assertEquals(response.status_code, 304)
+
+    def test_etag_follows_content(self):
+        etag = langnames.get_export_meta("codes-d43.txt")["etag"]
+        langnames.patch(2)
+        self.assertNotEquals(langnames.get_export_meta("codes-d43.txt")["etag"], etag)
+        self.assertEquals(langnames.get_export_meta("langnames.txt")["etag"], langnames.get_export("langnames.txt")["etag"])
+
+    def test_streams_until_rendered(self):
+        cache.delete(langnames.export_key("codes-d43.txt"))
+        cache.delete(langnames.export_meta_key("codes-d43.txt"))
+        response = codes_text_export(self.factory.get("/"))
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.has_header("ETag"))
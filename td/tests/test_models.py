@@ -1,16 +1,23 @@
 import json
 import os
 
+from django.contrib.contenttypes.models import ContentType
 from django.core import management
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from mock import patch
 
 from td.imports.models import WikipediaISOLanguage, EthnologueCountryCode, EthnologueLanguageCode, SIL_ISO_639_3, WikipediaISOCountry
+from td.imports.models import IMBPeopleGroup
+from td.resources.models import Media, Resource, Title
+from td.imports.tests.test_reloads import TemporarySnapshotsMixin
 
 from ..models import AdditionalLanguage
-from td.models import Language
-from ..tasks import integrate_imports, update_countries_from_imports
+from td.models import Country, Language, LanguageFingerprint, Region
+from td.utils import chunked_rows, joined_chunks
+from ..tasks import integrate_imb_language_data, integrate_imports, update_countries_from_imports
 
 
 class AdditionalLanguageTestCase(TestCase):
@@ -32,7 +39,7 @@ class AdditionalLanguageTestCase(TestCase):
         self.assertEquals(str(additional), "ttt-x-ismai")
 
 
-class LanguageIntegrationTests(TestCase):
+class LanguageIntegrationTests(TemporarySnapshotsMixin, TestCase):
 
     @classmethod
     def setUpClass(cls):
@@ -44,6 +51,7 @@ class LanguageIntegrationTests(TestCase):
         w_country = open(os.path.join(os.path.dirname(__file__), "../imports/tests/data/wikipedia_country.html")).read()
         with patch("requests.Session") as mock_requests:
             mock_requests.get().status_code = 200
+            mock_requests.get().headers = {}
             mock_requests.get().content = wikipedia
             WikipediaISOLanguage.reload(mock_requests)
             mock_requests.get().content = ethno
@@ -95,6 +103,76 @@ class LanguageIntegrationTests(TestCase):
         self.assertEquals(langs["es-419"]["lr"], "")
         self.assertEquals(langs["es-419"]["ld"], "ltr")
 
+    def test_reintegration_counts(self):
+        counts = integrate_imports(full=True)
+        self.assertEquals(counts["created"], 0)
+        self.assertEquals(counts["updated"], 0)
+        self.assertEquals(counts["attributes"], 0)
+        self.assertEquals(counts["unchanged"], Language.objects.count())
+        Language.objects.filter(code="aa").update(name="Afar")
+        counts = integrate_imports(full=True)
+        self.assertEquals(counts["updated"], 1)
+        self.assertEquals(Language.objects.get(code="aa").name, "Afaraf")
+
+    def test_only_changed_languages_reintegrated(self):
+        counts = integrate_imports()
+        self.assertEquals((counts["created"], counts["updated"], counts["unchanged"]), (0, 0, 0))
+        self.assertEquals(counts["skipped"], Language.objects.count())
+        SIL_ISO_639_3.objects.filter(code="kmg").update(ref_name="Kate")
+        Language.objects.filter(code="aa").update(name="Afar")
+        with patch("td.receivers.update_langnames_entry") as update:
+            with CaptureQueriesContext(connection) as queries:
+                counts = integrate_imports()
+        self.assertEquals((counts["updated"], counts["skipped"]), (1, Language.objects.count() - 1))
+        self.assertEquals(Language.objects.get(code="kmg").name, "Kate")
+        # the manual edit is left alone, as its source rows did not change
+        self.assertEquals(Language.objects.get(code="aa").name, "Afar")
+        update.delay.assert_called_once_with(Language.objects.get(code="kmg").pk)
+        self.assertTrue(len(queries) < 25)
+
+    def test_fingerprints_of_dropped_codes_forgotten(self):
+        LanguageFingerprint.objects.create(code="zz-gone", fingerprint="0" * 40)
+        integrate_imports()
+        self.assertFalse(LanguageFingerprint.objects.filter(code="zz-gone").exists())
+        self.assertTrue(LanguageFingerprint.objects.filter(code="kmg").exists())
+
+    def test_reintegrated_when_country_resolves(self):
+        Country.objects.filter(code="PG").update(code="QQ")
+        integrate_imports()
+        self.assertIsNone(Language.objects.get(code="kmg").country)
+        Country.objects.filter(code="QQ").update(code="PG")
+        integrate_imports()
+        self.assertEquals(Language.objects.get(code="kmg").country.code, "PG")
+
+    def test_integration_records_sources(self):
+        language = Language.objects.get(code="kmg")
+        country = language.country
+        self.assertEquals(country.code, "PG")
+        self.assertTrue(language.attributes.filter(
+            attribute="country_id",
+            value=str(country.pk),
+            source_ct=ContentType.objects.get_for_model(EthnologueCountryCode)
+        ).exists())
+        self.assertTrue(language.attributes.filter(attribute="name", value=language.name).exists())
+
+    def test_country_reconcile_report(self):
+        report = update_countries_from_imports()
+        self.assertEquals((report["created"], report["updated"]), ([], {}))
+        self.assertEquals(report["unchanged"], Country.objects.count())
+        Country.objects.filter(code="PG").update(name="PNG", region=None)
+        with CaptureQueriesContext(connection) as queries:
+            report = update_countries_from_imports()
+        self.assertEquals(report["updated"]["PG"]["name"], ["PNG", "Papua New Guinea"])
+        country = Country.objects.get(code="PG")
+        self.assertEquals(country.region.name, "Pacific")
+        self.assertEquals(report["updated"]["PG"]["region_id"], [None, country.region_id])
+        self.assertTrue(country.attributes.filter(
+            attribute="region_id",
+            value=str(country.region_id),
+            source_ct=ContentType.objects.get_for_model(EthnologueCountryCode)
+        ).exists())
+        self.assertTrue(len(queries) < 20)
+
     def test_three_letter_field(self):
         additional = AdditionalLanguage(
             two_letter="z3",
@@ -132,3 +210,112 @@ class LanguageIntegrationTests(TestCase):
         langs = {x["lc"]: x for x in data}
         self.assertTrue("zzz-r-test" in langs)
         self.assertEquals(langs["zzz-r-test"]["ld"], "rtl")
+
+
+class IMBIntegrationTests(TestCase):
+
+    def setUp(self):
+        self.chad = Country.objects.create(code="TD", name="Chad")
+        self.niger = Country.objects.create(code="NE", name="Niger")
+        self.by_iso = Language.objects.create(code="zz1", iso_639_3="zza")
+        self.by_code = Language.objects.create(code="zzb")
+        self.group(1, "zza", "Zaza", "Chad", jesus_film=True, gospel_recording=True)
+        self.group(2, "zza", "Zaza", "Niger")
+        self.group(3, "zzb", "Zeb", "Niger", written_scripture=True)
+        self.group(4, "qqq", "Unknown", "Chad", jesus_film=True)
+
+    def group(self, peid, rol, language, country, **flags):
+        return IMBPeopleGroup.objects.create(
+            peid=peid, rol=rol, language=language, country=country,
+            rop3=0, latitude=0, longitude=0, **flags
+        )
+
+    def test_resources_and_countries(self):
+        counts = integrate_imb_language_data()
+        self.assertEquals((counts["resources_created"], counts["media_links"]), (3, 3))
+        self.assertEquals(
+            sorted(Resource.objects.filter(language=self.by_iso).values_list("title__slug", "medias__slug")),
+            [(u"gospel-recording-grn", u"audio"), (u"jesus-film", u"video")]
+        )
+        self.assertTrue(Resource.objects.get(language=self.by_code).published_flag)
+        # the last group of a language sets its country
+        self.assertEquals(Language.objects.get(pk=self.by_iso.pk).country, self.niger)
+        self.assertEquals(
+            sorted(self.by_iso.attributes.filter(attribute="country_id").values_list("value", "source_id")),
+            sorted([(str(self.chad.pk), 1), (str(self.niger.pk), 2)])
+        )
+
+    def test_rerun_writes_nothing(self):
+        integrate_imb_language_data()
+        Resource.objects.update(published_flag=False)
+        with CaptureQueriesContext(connection) as queries:
+            counts = integrate_imb_language_data()
+        self.assertEquals(counts, {
+            "resources_created": 0,
+            "resources_published": 3,
+            "media_links": 0,
+            "languages_updated": 0,
+            "attributes": 0
+        })
+        self.assertTrue(len(queries) < 20)
+
+    def test_only_linked_titles_created(self):
+        integrate_imb_language_data()
+        self.assertEquals(
+            sorted(Title.objects.values_list("slug", flat=True)),
+            [u"bible-portions", u"gospel-recording-grn", u"jesus-film"]
+        )
+        self.assertEquals(sorted(Media.objects.values_list("slug", flat=True)), [u"audio", u"print", u"video"])
+
+
+class LanguageNamesDataTests(TestCase):
+
+    def setUp(self):
+        self.region = Region.objects.create(name="Pacific", slug="pacific")
+        self.source_ct = ContentType.objects.get_for_model(Country)
+
+    def add_languages(self, start, count):
+        for i in range(start, start + count):
+            country = Country.objects.create(code="{0:02d}".format(i), name="Country {0}".format(i), region=self.region)
+            language = Language.objects.create(code="zz{0}".format(i), name=u"K\xe2te {0}".format(i), country=country)
+            language.attributes.create(
+                attribute="country_id",
+                value=str(country.pk),
+                source_ct=self.source_ct,
+                source_id=country.pk
+            )
+
+    def names_data_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            Language.names_data()
+        return len(context.captured_queries)
+
+    def test_query_count_is_flat(self):
+        self.add_languages(0, 2)
+        small = self.names_data_queries()
+        self.add_languages(2, 20)
+        self.assertEquals(self.names_data_queries(), small)
+
+    def test_streamed_text_exports(self):
+        self.add_languages(0, 3)
+        self.assertEquals("".join(Language.codes_text_chunks()), Language.codes_text())
+        self.assertEquals("".join(Language.names_text_chunks()), Language.names_text())
+        self.assertEquals(list(joined_chunks(["a", "b", "c"], " ", chunk_size=2)), ["a b", " c"])
+
+    def test_chunked_rows(self):
+        self.add_languages(0, 5)
+        queryset = Language.objects.values_list("code", "name")
+        rows = chunked_rows(queryset, "code", chunk_size=2)
+        self.assertEquals(list(rows), list(queryset.order_by("code")))
+
+    def test_matches_instance_properties(self):
+        self.add_languages(0, 3)
+        Language.objects.create(code="zz-none", name="No Country", direction="r")
+        for entry in Language.names_data():
+            language = Language.objects.get(pk=entry["pk"])
+            self.assertEquals(entry["lc"], language.lc)
+            self.assertEquals(entry["ln"], language.ln)
+            self.assertEquals(entry["ang"], language.ang)
+            self.assertEquals(entry["cc"], language.cc_all)
+            self.assertEquals(entry["lr"], language.lr)
+            self.assertEquals(entry["ld"], language.get_direction_display())
@@ -0,0 +1,57 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from mock import Mock, patch
+
+from td.models import Language
+from .. import rebuilds
+
+
+class RebuildSchedulingTestCase(TestCase):
+
+    def setUp(self):
+        self.task = Mock()
+        self.task.name = "td.tests.rebuild"
+        cache.delete("rebuild_scheduled:td.tests.rebuild")
+
+    def test_requests_within_window_collapse(self):
+        for _ in range(3):
+            rebuilds.schedule(self.task)
+        self.assertEquals(self.task.apply_async.call_count, 1)
+        self.task.apply_async.assert_called_with(countdown=rebuilds.REBUILD_WINDOW)
+
+    def test_deferred_until_block_exits(self):
+        with rebuilds.deferred_rebuilds():
+            with rebuilds.deferred_rebuilds():
+                rebuilds.schedule(self.task)
+            rebuilds.schedule(self.task)
+            self.assertFalse(self.task.apply_async.called)
+        self.assertEquals(self.task.apply_async.call_count, 1)
+        self.assertFalse(rebuilds.deferring())
+
+    def test_dropped_on_rollback(self):
+        with self.assertRaises(ValueError):
+            with rebuilds.deferred_rebuilds():
+                rebuilds.schedule(self.task)
+                raise ValueError()
+        self.assertFalse(self.task.apply_async.called)
+        self.assertFalse(rebuilds.deferring())
+
+    def test_decorator(self):
+        @rebuilds.deferred_rebuilds()
+        def bulk():
+            rebuilds.schedule(self.task)
+            self.assertTrue(rebuilds.deferring())
+            self.assertFalse(self.task.apply_async.called)
+
+        bulk()
+        self.assertEquals(self.task.apply_async.call_count, 1)
+
+    def test_language_saves_in_bulk_schedule_one_rebuild(self):
+        with patch("td.receivers.reset_langnames_cache") as reset, patch("td.receivers.update_langnames_entry") as update:
+            reset.name = "td.tests.rebuild"
+            with rebuilds.deferred_rebuilds():
+                for code in ["zb1", "zb2", "zb3"]:
+                    Language.objects.create(code=code, name=code)
+            self.assertEquals(reset.apply_async.call_count, 1)
+            self.assertFalse(update.delay.called)
@@ -0,0 +1,54 @@
+from django.test import TestCase
+from django.utils import timezone
+
+from td.models import AdditionalLanguage, Country, Language
+from td.tracking.models import Charter, Department
+from td.tracking.views import AjaxCharterListView
+from td.utils import RowProjection
+from td.views import AjaxAdditionalLanguageListView, AjaxIMBPeopleGroupListView, AjaxLanguageListView
+
+
+class RowProjectionTestCase(TestCase):
+
+    def setUp(self):
+        country = Country.objects.create(code="rp", name="Projection Land")
+        gateway = Language.objects.create(code="rpg", name="Gateway", gateway_flag=True, country=country)
+        language = Language.objects.create(code="rpl", name=u"L\xe0ngue", gateway_language=gateway)
+        AdditionalLanguage.objects.create(ietf_tag="rp-x", common_name="Extra", direction="r")
+        Charter.objects.create(
+            language=language,
+            start_date=timezone.now().date(),
+            end_date=timezone.now().date(),
+            lead_dept=Department.objects.create(name="Dept")
+        )
+
+    def assertSameRows(self, view_class):
+        view = view_class(kwargs={})
+        projection = view_class.row_projection()
+        self.assertIsNotNone(projection)
+        queryset = view.queryset.order_by("pk")
+        self.assertEquals(
+            [projection.format_row(values) for values in projection.values(queryset)],
+            [view.format_row(obj) for obj in queryset]
+        )
+
+    def test_matches_format_row(self):
+        for view_class in [AjaxLanguageListView, AjaxAdditionalLanguageListView, AjaxCharterListView]:
+            self.assertSameRows(view_class)
+
+    def test_compiled_once_per_class(self):
+        self.assertIs(AjaxLanguageListView.row_projection(), AjaxLanguageListView.row_projection())
+        self.assertIsNot(AjaxIMBPeopleGroupListView.row_projection(), AjaxLanguageListView.row_projection())
+
+    def test_non_field_columns_fall_back(self):
+        class View(AjaxLanguageListView):
+            fields = ["code", "cc"]
+        self.assertIsNone(RowProjection.compile(View))
+        self.assertIsNone(View.row_projection())
+
+    def test_page_query_count(self):
+        view = AjaxLanguageListView(kwargs={})
+        view.request = type("Request", (), {"GET": {"start": "0", "length": "10"}})()
+        with self.assertNumQueries(1):
+            rows = view.page_rows(view.queryset.filter(code="rpg"), 1)
+        self.assertEquals(rows[0][0], u'<a href="/uw/languages/{0}/">rpg</a>'.format(Language.objects.get(code="rpg").pk))
@@ -0,0 +1,19 @@
+from contextlib import contextmanager
+
+from django.db import connection
+
+from td import rebuilds
+
+
+@contextmanager
+def committed():
+    """
+    Run the commit hooks requested in the block as if its transaction had
+    committed; a TestCase never commits its own.
+    """
+    yield
+    hooks = rebuilds.commit_hooks(connection)
+    pending = list(hooks.values())
+    hooks.clear()
+    for sids, func in pending:
+        func()
@@ -73,7 +73,7 @@ class CharterTableSourceView(DataTableSourceView):
                     [Q(language__name__istartswith=self.search_term)]
                 )
             ).order_by("start_date")
-            if qs.count():
+            if qs.exists():
                 return qs
         return self.queryset.filter(
             reduce(
@@ -103,7 +103,7 @@ class EventTableSourceView(DataTableSourceView):
                     [Q(number__icontains=self.search_term)]
                 )
             ).order_by("start_date")
-            if qs.count():
+            if qs.exists():
                 return qs
         return self.queryset.filter(
             reduce(
@@ -127,7 +127,7 @@ class AjaxCharterListView(CharterTableSourceView):
     # link is on column because name can't handle non-roman characters
     link_column = "language__code"
     link_url_name = "language_detail"
-    link_url_field = "lang_id"
+    link_url_field = "language_id"
 
 
 class AjaxCharterEventsListView(EventTableSourceView):
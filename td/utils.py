@@ -1,8 +1,14 @@
+import hashlib
+import itertools
 import operator
 
-from django.core.paginator import Paginator
-from django.db.models import Q
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connection
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import AutoField, BooleanField, NullBooleanField, Q
 from django.http import JsonResponse
+from django.utils.encoding import force_bytes, force_text
 from django.views.generic import View
 from django.template import Variable, VariableDoesNotExist
 from django.core.urlresolvers import reverse
@@ -11,6 +17,8 @@ from xml.dom import minidom
 from svglib.svglib import SvgRenderer
 from reportlab.graphics import renderPDF
 
+from . import caching
+
 
 def str_to_bool(value, allow_null=False):
     if str(value).strip().lower() in ["yes", "true", "1", "y"]:
@@ -23,6 +31,80 @@ def str_to_bool(value, allow_null=False):
         return False
 
 
+def url_template(name):
+    """
+    Return the URL of pattern `name`, which takes a single numeric argument,
+    as a format string to fill in per object instead of reversing each time
+    """
+    placeholder = 918273645
+    return reverse(name, args=[placeholder]).replace(str(placeholder), "{0}")
+
+
+def chunked_rows(queryset, key, chunk_size=2000):
+    """
+    Yield the rows of a `values_list()` queryset whose first column is the
+    unique field `key`, in `key` order. Each chunk of `chunk_size` rows is
+    its own short query seeking past the previous chunk, so no more than a
+    chunk is held in memory and no transaction or cursor stays open while
+    the rows are consumed, e.g. by a slow streaming client.
+    """
+    queryset = queryset.order_by(key)
+    rows = list(queryset[:chunk_size])
+    while rows:
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        rows = list(queryset.filter(**{"{0}__gt".format(key): rows[-1][0]})[:chunk_size])
+
+
+def bulk_update(model, rows, fields, batch_size=500):
+    """
+    Write `rows`, dicts holding a "pk" and a value for each of `fields`, back
+    to `model`'s table. On PostgreSQL each batch is a single
+    `UPDATE ... FROM (VALUES ...)` statement; other backends update per row.
+    """
+    if connection.vendor != "postgresql":
+        for row in rows:
+            model._default_manager.filter(pk=row["pk"]).update(**{f: row[f] for f in fields})
+        return
+    opts = model._meta
+    qn = connection.ops.quote_name
+    columns = [opts.pk] + [opts.get_field(f) for f in fields]
+    casts = ", ".join(
+        "CAST(%s AS {0})".format("integer" if isinstance(f, AutoField) else f.db_type(connection))
+        for f in columns
+    )
+    sql = "UPDATE {table} SET {assignments} FROM (VALUES {{values}}) AS v ({columns}) WHERE {table}.{pk} = v.{pk}".format(
+        table=qn(opts.db_table),
+        assignments=", ".join("{0} = v.{0}".format(qn(f.column)) for f in columns[1:]),
+        columns=", ".join(qn(f.column) for f in columns),
+        pk=qn(opts.pk.column)
+    )
+    cursor = connection.cursor()
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        params = []
+        for row in batch:
+            params.append(columns[0].get_db_prep_save(row["pk"], connection))
+            params.extend(f.get_db_prep_save(row[name], connection) for f, name in zip(columns[1:], fields))
+        cursor.execute(sql.format(values=", ".join("({0})".format(casts) for _ in batch)), params)
+
+
+def joined_chunks(parts, separator, chunk_size=1000):
+    """
+    Join `parts` with `separator` like `separator.join(parts)`, but yield
+    the result in pieces of `chunk_size` parts for streaming responses.
+    """
+    parts = iter(parts)
+    chunk = list(itertools.islice(parts, chunk_size))
+    prefix = ""
+    while chunk:
+        yield prefix + separator.join(chunk)
+        prefix = separator
+        chunk = list(itertools.islice(parts, chunk_size))
+
+
 def svg_to_pdf(svg_data):
     svgr = SvgRenderer()
     doc = minidom.parseString(svg_data.encode("utf-8"))
@@ -32,8 +114,290 @@ def svg_to_pdf(svg_data):
     return pdf
 
 
+def search_document(columns, table=None):
+    """
+    Return the SQL expression searched by `TrigramSearch`: the upper-cased
+    text of each column, joined by newlines. The index migrations carry a
+    copy of this expression, which the planner must match; changing it
+    needs a migration recreating those indexes.
+    """
+    qn = connection.ops.quote_name
+    prefix = "{0}.".format(qn(table)) if table else ""
+    return " || E'\\n' || ".join(
+        "coalesce(upper({0}{1}::text), '')".format(prefix, qn(column))
+        for column in columns
+    )
+
+
+def estimated_count(model):
+    """
+    Return the planner's row estimate for `model`'s table from the last
+    ANALYZE, or None off PostgreSQL or if the table was never analyzed
+    """
+    if connection.vendor != "postgresql":
+        return None
+    cursor = connection.cursor()
+    cursor.execute("select reltuples from pg_class where oid = %s::regclass", [model._meta.db_table])
+    row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class CountStrategy(object):
+    """
+    Count the rows of a DataTables endpoint. The unfiltered total is cached
+    per generation of the model, with tables over `estimate_threshold` rows
+    taking the planner's estimate instead of a COUNT(*); without a search
+    term the filtered count is the total.
+    """
+
+    estimate_threshold = 100000
+
+    def __init__(self, view):
+        self.view = view
+
+    def count_all(self, queryset):
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate
+        return queryset.count()
+
+    def total(self, queryset):
+        key = "datatable_total:{0}".format(hashlib.md5(force_bytes(queryset.query)).hexdigest())
+        depends = [caching.model_generation(queryset.model)]
+        return caching.get_derived(key, depends, lambda: self.count_all(queryset))
+
+    def filtered(self, queryset, total):
+        if not self.view.search_term:
+            return total
+        return queryset.count()
+
+
+class CountedPaginator(Paginator):
+    """
+    A paginator over a queryset whose row count is already known
+    """
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super(CountedPaginator, self).__init__(object_list, per_page, **kwargs)
+        self._count = count
+
+
+class KeysetPaginator(object):
+    """
+    Pages a queryset ordered by a single column of its own table by seeking
+    past the (column, id) of the row before the page instead of OFFSETting
+    to it; a (column, id) index answers the seek. The last row of every full
+    page served is remembered for the data's current generation, so paging
+    on from any page served before costs the same at any depth; a start with
+    no remembered row falls back to OFFSET once.
+    """
+
+    def __init__(self, queryset, per_page, field):
+        self.field = field.lstrip("-")
+        self.descending = field.startswith("-")
+        self.per_page = per_page
+        self.queryset = queryset.order_by(field, "-pk" if self.descending else "pk")
+        self.name = "keyset:{0}".format(hashlib.md5(force_bytes(self.queryset.query)).hexdigest())
+        self.depends = [caching.model_generation(queryset.model)]
+        opts = queryset.model._meta
+        qn = connection.ops.quote_name
+        model_field = opts.pk if self.field == "pk" else opts.get_field(self.field)
+        self.null = model_field.null
+        self.column = "{0}.{1}".format(qn(opts.db_table), qn(model_field.column))
+        self.pk_column = "{0}.{1}".format(qn(opts.db_table), qn(opts.pk.column))
+
+    @classmethod
+    def for_queryset(cls, queryset, per_page):
+        """
+        Return a paginator for `queryset`, or None if it is not ordered by
+        exactly one database field of its own model, or by a nullable one on
+        a database that does not sort NULLs last
+        """
+        ordering = queryset.query.order_by
+        if len(ordering) != 1 or "?" in ordering[0] or "__" in ordering[0]:
+            return None
+        field = field_path(queryset.model, ordering[0].lstrip("-"))
+        if field is None or (field.null and not connection.features.nulls_order_largest):
+            return None
+        return cls(queryset, per_page, ordering[0])
+
+    def after(self, value, pk):
+        """
+        Return the queryset past the row (`value`, `pk`); NULLs sort as the
+        largest values
+        """
+        op = "<" if self.descending else ">"
+        if value is None:
+            where = "{0} IS NULL AND {1} {2} %s".format(self.column, self.pk_column, op)
+            if self.descending:
+                where = "{0} IS NOT NULL OR {1}".format(self.column, where)
+            params = [pk]
+        else:
+            where = "({0}, {1}) {2} (%s, %s)".format(self.column, self.pk_column, op)
+            if self.null and not self.descending:
+                where = "{0} OR {1} IS NULL".format(where, self.column)
+            params = [value, pk]
+        return self.queryset.extra(where=["({0})".format(where)], params=params)
+
+    def boundary_key(self, start):
+        return caching.derived_key("{0}:{1}".format(self.name, start), self.depends)
+
+    def page(self, start, values):
+        """
+        Return the rows from `start`, read through `values`, which turns the
+        queryset into one of dicts including the field and pk
+        """
+        boundary = cache.get(self.boundary_key(start)) if start else None
+        if start and boundary is None:
+            rows = list(values(self.queryset)[start:start + self.per_page])
+        elif boundary is not None:
+            rows = list(values(self.after(*boundary))[:self.per_page])
+        else:
+            rows = list(values(self.queryset)[:self.per_page])
+        if len(rows) == self.per_page:
+            last = rows[-1]
+            cache.set(self.boundary_key(start + len(rows)), (last[self.field], last["pk"]), caching.DERIVED_TIMEOUT)
+        return rows
+
+
+class ContainsSearch(object):
+    """
+    Match rows where any of the view's search fields contains the search
+    term, each with its own `icontains` predicate
+    """
+
+    def __init__(self, view):
+        self.view = view
+
+    def filter(self, queryset):
+        if not self.view.search_term:
+            return queryset
+        return queryset.filter(
+            reduce(
+                operator.or_,
+                [Q(x) for x in self.view.filter_predicates]
+            )
+        )
+
+
+class TrigramSearch(ContainsSearch):
+    """
+    Match the search term against one document built from all the search
+    fields, which a pg_trgm GIN index (see imports migration 0005) can answer
+    without scanning the table. Falls back to `ContainsSearch` off
+    PostgreSQL or when a search field spans a relation.
+    """
+
+    def filter(self, queryset):
+        fields = self.view.search_fields
+        if connection.vendor != "postgresql" or any("__" in f for f in fields):
+            return super(TrigramSearch, self).filter(queryset)
+        term = self.view.search_term
+        if not term:
+            return queryset
+        opts = queryset.model._meta
+        document = search_document([opts.get_field(f).column for f in fields], opts.db_table)
+        return queryset.extra(
+            where=["({0}) like upper(%s)".format(document)],
+            params=[u"%{0}%".format(connection.ops.prep_for_like_query(term))]
+        )
+
+
+BOOLEAN_CELLS = {
+    True: '<i class="fa fa-check text-success"></i>',
+    False: '<i class="fa fa-times text-danger"></i>'
+}
+
+
+def field_path(model, path):
+    """
+    Return the field `path`, a field name with `__` between relations, ends
+    at, or None if it is not a single-valued, non-relation database field
+    """
+    parts = path.split("__")
+    for part in parts[:-1]:
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+        if not (field.many_to_one or field.one_to_one) or not field.concrete:
+            return None
+        model = field.related_model
+    try:
+        field = model._meta.pk if parts[-1] == "pk" else model._meta.get_field(parts[-1])
+    except FieldDoesNotExist:
+        return None
+    if field.is_relation or not field.concrete:
+        return None
+    return field
+
+
+class RowProjection(object):
+    """
+    Serializes DataTables rows straight from `values()`, with each column's
+    choice or boolean display precomputed as a dict and links formatted from
+    a URL template, so a cell costs one lookup. Built once per view class by
+    `compile`, which returns None if a column is not a plain database field.
+    """
+
+    def __init__(self, columns, link=None):
+        self.columns = columns
+        self.keys = [key for key, _ in columns]
+        self.link = link
+
+    @classmethod
+    def compile(cls, view_class):
+        columns = []
+        for name in view_class.fields:
+            field = field_path(view_class.model, name)
+            if field is None:
+                return None
+            if "__" not in name and field.choices:
+                display = {k: force_text(v, strings_only=True) for k, v in field.flatchoices}
+            elif isinstance(field, (BooleanField, NullBooleanField)):
+                display = BOOLEAN_CELLS
+            else:
+                display = None
+            columns.append((name, display))
+        link = None
+        if getattr(view_class, "link_column", None) in view_class.fields:
+            if view_class.link_url_field == "pk":
+                key = "pk"
+            else:
+                try:
+                    key = view_class.model._meta.get_field(view_class.link_url_field).name
+                except FieldDoesNotExist:
+                    return None
+            link = (view_class.fields.index(view_class.link_column), key, url_template(view_class.link_url_name))
+        return cls(columns, link)
+
+    def values(self, queryset, extra=()):
+        keys = list(self.keys)
+        for key in ([self.link[1]] if self.link else []) + list(extra):
+            if key not in keys:
+                keys.append(key)
+        return queryset.values(*keys)
+
+    def format_row(self, values):
+        row = [
+            values[key] if display is None else display.get(values[key], values[key])
+            for key, display in self.columns
+        ]
+        if self.link:
+            i, key, url = self.link
+            row[i] = u'<a href="{0}">{1}</a>'.format(url.format(values[key]), row[i])
+        return row
+
+
 class DataTableSourceView(View):
 
+    search_backend = ContainsSearch
+    count_strategy = CountStrategy
+    keyset_pagination = False
+
     def __init__(self, **kwargs):
         super(DataTableSourceView, self).__init__(**kwargs)
 
@@ -72,21 +436,20 @@ class DataTableSourceView(View):
     def draw(self):
         return int(self.request.GET.get("draw"))
 
+    @property
+    def search_fields(self):
+        return self.fields
+
     @property
     def filter_predicates(self):
         return [
             ("{0}__icontains".format(field), self.search_term)
-            for field in self.fields
+            for field in self.search_fields
         ]
 
     @property
     def filtered_data(self):
-        return self.queryset.filter(
-            reduce(
-                operator.or_,
-                [Q(x) for x in self.filter_predicates]
-            )
-        ).order_by(
+        return self.search_backend(self).filter(self.queryset).order_by(
             self.order_by
         )
 
@@ -98,11 +461,36 @@ class DataTableSourceView(View):
     def order_by(self):  # @@@ expand on this if multi-column ordering is needed
         return "{0}{1}".format(self.order_direction, self.order_field)
 
+    @classmethod
+    def row_projection(cls):
+        if "_row_projection" not in cls.__dict__:
+            cls._row_projection = RowProjection.compile(cls)
+        return cls._row_projection
+
+    def page_rows(self, queryset, count):
+        projection = self.row_projection()
+        keyset = None
+        if self.keyset_pagination and projection is not None:
+            keyset = KeysetPaginator.for_queryset(queryset, self.paging_page_length)
+        if keyset is not None:
+            rows = keyset.page(self.paging_start_record, lambda qs: projection.values(qs, [keyset.field, "pk"]))
+            return [projection.format_row(values) for values in rows]
+        if projection is not None:
+            queryset = projection.values(queryset)
+        paginator = CountedPaginator(queryset, self.paging_page_length, count, orphans=0, allow_empty_first_page=True)
+        try:
+            page = paginator.page(self.current_page)
+        except EmptyPage:
+            # past the end of an estimated count
+            return []
+        if projection is not None:
+            return [projection.format_row(values) for values in page.object_list]
+        return [self.format_row(obj) for obj in page.object_list]
+
     @property
     def data(self):
-        paginator = Paginator(self.filtered_data, self.paging_page_length, orphans=0, allow_empty_first_page=True)
-        page = paginator.page(self.current_page)
-        return [self.format_row(obj) for obj in page.object_list]
+        filtered = self.filtered_data
+        return self.page_rows(filtered, filtered.count())
 
     def format_row(self, obj):
         row = []
@@ -116,32 +504,23 @@ class DataTableSourceView(View):
                 except VariableDoesNotExist:
                     v = None
                 if isinstance(v, bool):
-                    if v:
-                        row.append('<i class="fa fa-check text-success"></i>')
-                    else:
-                        row.append('<i class="fa fa-times text-danger"></i>')
+                    row.append(BOOLEAN_CELLS[v])
                 else:
                     if hasattr(self, "link_column") and self.link_column == field:
-                        # NOTE: Added if statement and the first conditional code to make this work with linking project list to language detail.
-                        #   The problems with the original one (under else) are:
-                        #       1. Charter model has 'lang_id' attribute that gets the related language's pk, but then the reverse() finds no match since
-                        #          'uw/language_detail/' looks for a "pk" as an argument, not a "lang_id".
-                        #       2. Charter model should not have more than one "pk" as attributes (one refers to itself, one refers to the related language's pk)
-                        #   Solution:
-                        #       1. Rename the kwargs key to "pk" if the link_url_field is "lang_id"
-                        # NOTE by Vicky Leong, 10.12.15
-                        if (self.link_url_field == "lang_id"):
-                            row.append('<a href="{0}">{1}</a>'.format(reverse(self.link_url_name, kwargs={"pk": getattr(obj, self.link_url_field)}), v))
-                        else:
-                            row.append('<a href="{0}">{1}</a>'.format(reverse(self.link_url_name, kwargs={self.link_url_field: getattr(obj, self.link_url_field)}), v))
+                        url = reverse(self.link_url_name, args=[getattr(obj, self.link_url_field)])
+                        row.append('<a href="{0}">{1}</a>'.format(url, v))
                     else:
                         row.append(v)
         return row
 
     def get(self, request, *args, **kwargs):
+        counts = self.count_strategy(self)
+        total = counts.total(self.all_data)
+        filtered = self.filtered_data
+        filtered_total = counts.filtered(filtered, total)
         return JsonResponse({
-            "data": self.data,
+            "data": self.page_rows(filtered, filtered_total),
             "draw": self.draw,
-            "recordsTotal": self.all_data.count(),
-            "recordsFiltered": self.filtered_data.count()
+            "recordsTotal": total,
+            "recordsFiltered": filtered_total
         })
@@ -5,10 +5,13 @@ from django.contrib import messages
 from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import quote_etag
 from django.shortcuts import redirect, render, get_object_or_404
 from django.views.generic import TemplateView, ListView, DetailView, UpdateView, CreateView
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 
 from td.imports.models import (
     EthnologueCountryCode,
@@ -20,29 +23,80 @@ from td.imports.models import (
 )
 from td.tracking.models import Event
 from td.models import Language, Country, Region, Network
+from . import caching, langnames
 from .models import AdditionalLanguage
 from td.forms import NetworkForm, CountryForm, LanguageForm, UploadGatewayForm
-from td.resources.models import transform_country_data
-from td.resources.tasks import get_map_gateways
+from td.resources.tasks import get_country_tree, get_map_gateways
 from td.resources.views import EntityTrackingMixin
+from .rebuilds import deferred_rebuilds
 from .tasks import reset_langnames_cache
-from .utils import DataTableSourceView, svg_to_pdf
+from .utils import DataTableSourceView, TrigramSearch, svg_to_pdf
 
 
-def codes_text_export(request):
-    return HttpResponse(Language.codes_text(), content_type="text/plain")
+def accepts_gzip(request):
+    return "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
 
 
-def names_text_export(request):
-    return HttpResponse(Language.names_text(), content_type="text/plain")
+def export_etag(name):
+    def etag_func(request, *args, **kwargs):
+        meta = langnames.get_export_meta(name)
+        if meta is None:
+            return None
+        if accepts_gzip(request):
+            return "{0}-gzip".format(meta["etag"])
+        return meta["etag"]
+    return etag_func
 
 
-def names_json_export(request):
+def export_last_modified(name):
+    def last_modified_func(request, *args, **kwargs):
+        meta = langnames.get_export_meta(name)
+        return meta["last_modified"] if meta is not None else None
+    return last_modified_func
+
+
+def prerendered_export(name, content_type, fallback):
+    """
+    Serve an export from its pre-rendered payload. Conditional requests are
+    answered from the export's ETag and Last-Modified alone; `fallback` only
+    runs while the export has not been rendered yet.
+    """
+    @condition(etag_func=export_etag(name), last_modified_func=export_last_modified(name))
+    def view(request):
+        export = langnames.get_export(name)
+        if export is None:
+            return fallback(request)
+        if accepts_gzip(request):
+            response = HttpResponse(export["gzip"], content_type=content_type)
+            response["Content-Encoding"] = "gzip"
+            response["ETag"] = quote_etag("{0}-gzip".format(export["etag"]))
+        else:
+            response = HttpResponse(export["content"], content_type=content_type)
+            response["ETag"] = quote_etag(export["etag"])
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+    return view
+
+
+def stream_codes_text(request):
+    return StreamingHttpResponse(Language.codes_text_chunks(), content_type="text/plain")
+
+
+def stream_names_text(request):
+    return StreamingHttpResponse(Language.names_text_chunks(), content_type="text/plain")
+
+
+def render_names_json(request):
     # Set safe to False to allow list instead of dict to be returned
     data = get_langnames()
     return JsonResponse(data, safe=False)
 
 
+codes_text_export = prerendered_export("codes-d43.txt", "text/plain", stream_codes_text)
+names_text_export = prerendered_export("langnames.txt", "text/plain", stream_names_text)
+names_json_export = prerendered_export("langnames.json", "application/json", render_names_json)
+
+
 @csrf_exempt
 def export_svg(request):
     svg = request.POST.get("data")
@@ -68,34 +122,8 @@ def get_langnames():
 
 
 def languages_autocomplete(request):
-    term = request.GET.get("q").lower()
-    data = get_langnames()
-    d = []
-    if len(term) <= 3:
-        term = term.encode("utf-8")
-        # search: cc, lc
-        # first do a *starts with* style search of language code (lc)
-        d.extend([
-            x
-            for x in data
-            if term == x["lc"].lower()[:len(term)]
-        ])
-        d.extend([
-            x
-            for x in data
-            if term in [y.lower() for y in x["cc"]]
-        ])
-    if len(term) >= 3:
-        # search: lc, ln, lr
-        term = term.encode("utf-8")
-        d.extend([
-            x
-            for x in data
-            if (
-                term in x["lc"] or term in x["ln"].lower()
-                or term in x["ang"].lower() or term in x["lr"].lower()
-            )
-        ])
+    term = request.GET.get("q").lower().encode("utf-8")
+    d = langnames.get_index(get_langnames).search(term)
     return JsonResponse({"results": d, "count": len(d), "term": term})
 
 
@@ -161,6 +189,8 @@ class AjaxEthnologueLanguageCodeListView(DataTableSourceView):
 
 class AjaxEthnologueLanguageIndexListView(DataTableSourceView):
     model = EthnologueLanguageIndex
+    search_backend = TrigramSearch
+    keyset_pagination = True
     fields = [
         "language_code",
         "country_code",
@@ -171,6 +201,7 @@ class AjaxEthnologueLanguageIndexListView(DataTableSourceView):
 
 class AjaxSIL_ISO_639_3ListView(DataTableSourceView):
     model = SIL_ISO_639_3
+    search_backend = TrigramSearch
     fields = [
         "code",
         "part_2b",
@@ -200,6 +231,7 @@ class AjaxWikipediaISOLanguageListView(DataTableSourceView):
 
 class AjaxIMBPeopleGroupListView(DataTableSourceView):
     model = IMBPeopleGroup
+    search_backend = TrigramSearch
     fields = [
         "peid",
         "affinity_bloc",
@@ -224,7 +256,7 @@ class AjaxIMBPeopleGroupListView(DataTableSourceView):
 
 @login_required
 def country_tree_data(request):
-    return JsonResponse(transform_country_data(Country.gateway_data()))
+    return JsonResponse(get_country_tree())
 
 
 def country_map_data(request):
@@ -277,6 +309,7 @@ def upload_gateway_flag_file(request):
         if form.is_valid():
             Language.objects.filter(gateway_flag=True).update(gateway_flag=False)
             Language.objects.filter(code__in=form.cleaned_data["languages"]).update(gateway_flag=True)
+            caching.bump(caching.LANGUAGE)
             messages.add_message(request, messages.SUCCESS, "Gateway languages updated")
             return redirect("gateway_flag_update")
     else:
@@ -296,10 +329,11 @@ def upload_rtl_list(request):
     if request.method == "POST":
         form = UploadGatewayForm(request.POST)
         if form.is_valid():
-            for lang in Language.objects.filter(code__in=form.cleaned_data["languages"]):
-                lang.direction = "r"
-                lang.source = request.user
-                lang.save()
+            with deferred_rebuilds():
+                for lang in Language.objects.filter(code__in=form.cleaned_data["languages"]):
+                    lang.direction = "r"
+                    lang.source = request.user
+                    lang.save()
             messages.add_message(request, messages.SUCCESS, "RTL languages updated")
             return redirect("rtl_languages_update")
     else:
@@ -390,7 +424,7 @@ class LanguageTableSourceView(DataTableSourceView):
         search_term = self.search_term.strip()
         if search_term and len(search_term) <= 3:
             qs = self.queryset.filter(code__startswith=search_term.lower())
-            if qs.count():
+            if qs.exists():
                 return qs.order_by("code")
 
         return super(LanguageTableSourceView, self).filtered_data
@@ -402,6 +436,7 @@ class LanguageListView(TemplateView):
 
 class AjaxLanguageListView(LanguageTableSourceView):
     model = Language
+    keyset_pagination = True
     fields = [
         "code",
         "iso_639_3",